@@ -0,0 +1,360 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+import yaml
+
+# ANSI escape sequences for colors
+class Colors:
+    CYAN = '\033[96m'
+    GREEN = '\033[92m'
+    YELLOW = '\033[93m'
+    RED = '\033[91m'
+    RESET = '\033[0m'
+
+# Directory of this script, the customization script and the example configuration live next to it
+BASE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+# Scenarios of one benchmark round, in the order they are run
+SCENARIOS = ('cold', 'rerun', 'upgrade')
+
+# Names of hashed chunks of a Jellyfin web build, the remaining chunks get numeric names
+CHUNK_NAMES = ('session-login-index-html', 'home-html', 'itemDetails-index-html', 'search-html', 'livetv-html',
+               'movies-html', 'tv-html', 'music-html', 'dashboard-general-html', 'user-display-html',
+               'mypreferencesmenu-html', 'list-html', 'favorites-html', 'requests-html', 'videoosd-html')
+
+# Hashed icons and images of a Jellyfin web build
+ASSET_NAMES = ('icon-transparent.png', 'banner-light.png', 'banner-dark.png', 'favicon.ico', 'touchicon.png',
+               'notificationicon.png', 'touchicon72.png', 'touchicon114.png', 'touchicon144.png', 'splash.png')
+
+# Counters reported by the customization script in its summary
+SUMMARY_PATTERNS = {
+    "copies": re.compile(r'Total successful copies: (\d+)'),
+    "modifications": re.compile(r'Total file modifications: (\d+)'),
+    "cacheSkips": re.compile(r'Total skipped through the cache: (\d+)'),
+    "copyErrors": re.compile(r'Total copy errors: (\d+)'),
+    "modificationErrors": re.compile(r'Total modification errors: (\d+)'),
+}
+ANSI_ESCAPE = re.compile(r'\033\[[0-9;]*m')
+
+# Runs the customization script with an audit hook that counts file system events per process.
+# Forked worker processes count their own events, every process dumps its counters (and the
+# read/write syscall counters of /proc/self/io where available) into BENCH_COUNTERS_DIR on exit.
+BOOTSTRAP = r'''
+import atexit, collections, json, os, runpy, sys
+import multiprocessing.util
+
+counters = collections.Counter()
+counterDirectory = os.environ['BENCH_COUNTERS_DIR']
+
+def hook(event, args):
+    if event == 'open' or event.startswith(('os.', 'shutil.', 'mmap.', 'glob.')):
+        counters[event] += 1
+
+def dump():
+    data = {"events": dict(counters)}
+    try:
+        with open('/proc/self/io', 'r') as f:
+            data['io'] = {key: int(value) for key, value in (line.split(':') for line in f)}
+    except OSError:
+        pass
+    with open(os.path.join(counterDirectory, f'{os.getpid()}.json'), 'w') as f:
+        json.dump(data, f)
+
+def afterFork(counters):
+    counters.clear()
+    multiprocessing.util.Finalize(None, dump, exitpriority=0)
+
+atexit.register(dump)
+multiprocessing.util.register_after_fork(counters, afterFork)
+sys.addaudithook(hook)
+sys.argv = sys.argv[1:]
+sys.path.insert(0, os.path.dirname(os.path.abspath(sys.argv[0])))
+runpy.run_path(sys.argv[0], run_name='__main__')
+'''
+
+
+# MARK: Generate web tree
+def _hash(rng, length=20):
+    """Return a random lowercase hex hash like the ones in Jellyfin build file names."""
+    return f'{rng.getrandbits(length * 4):0{length}x}'
+
+
+def _codePool(rng, size=512):
+    """Build a pool of minified-looking JavaScript snippets (a few with UTF-8 translations)."""
+    words = ('render', 'update', 'apiClient', 'itemId', 'serverId', 'ParentId', 'Limit', 'Fields', 'userId',
+             'Überspringen', 'Suivant', 'Nästa', '次へ', 'Далее', 'playbackManager', 'loading', 'dom', 'events')
+    pool = []
+    for _ in range(size):
+        name, value = rng.choice(words), rng.choice(words)
+        pool.append(f'{rng.randint(1, 99999)}:function(e,t,n){{"use strict";var r=n({rng.randint(1, 99999)}),'
+                    f'o=n.n(r);t.a={{{name}:"{value}",get:function(){{return o()(this.{name},{rng.randint(0, 999)})}}}}}},')
+    return pool
+
+
+def _writeCode(path, rng, pool, size, markers=()):
+    """Write about size bytes of generated code with the markers spread over the file."""
+    snippets = rng.choices(pool, k=max(1, size // 120))
+    for marker in markers:
+        snippets.insert(rng.randint(0, len(snippets)), marker)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(''.join(snippets))
+
+
+def _writeBinary(path, rng, size):
+    """Write random binary content (images, icons)."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(rng.randbytes(size))
+
+
+def _plainMarkers(config, filename):
+    """Return the plain markers of all modification rules matching a file name (regex markers can't be generated)."""
+    markers = []
+    for rule in config.get('modification_rules', []):
+        try:
+            if not re.match(rule.get('file_pattern', '*'), filename):
+                continue
+        except re.error:
+            continue
+        for insertRule in rule.get('insert_rules', []):
+            markers.extend(insertRule[key] for key in ('after_text', 'before_text') if key in insertRule)
+        markers.extend(replaceRule['old_text'] for replaceRule in rule.get('replace_rules', []) if 'old_text' in replaceRule)
+    return [marker for marker in markers if isinstance(marker, str) and not marker.startswith('re:')]
+
+
+def generateWebTree(webDirectory, config, chunks, bundleSize, seed):
+    """Generate a Jellyfin-web like build: hashed chunks, a large main bundle, index.html and hashed icons.
+
+    The plain markers of the configuration's modification rules are embedded in the matching files.
+    Returns (number of files, total size in bytes).
+    """
+    rng = random.Random(seed)
+    pool = _codePool(random.Random(0))
+    os.makedirs(webDirectory, exist_ok=True)
+
+    def code(filename, size):
+        _writeCode(os.path.join(webDirectory, filename), rng, pool, size, _plainMarkers(config, filename))
+
+    cssName = f'main.jellyfin.{_hash(rng)}.css'
+    code('main.jellyfin.bundle.js', bundleSize)
+    code(cssName, 256 * 1024)
+    with open(os.path.join(webDirectory, 'index.html'), 'w', encoding='utf-8') as f:
+        f.write('<!DOCTYPE html><html class="preload" dir="ltr"><head><meta charset="utf-8">'
+                f'<link href="{cssName}?{_hash(rng, 12)}" rel="stylesheet">{"".join(_plainMarkers(config, "index.html"))}'
+                '</head><body dir="ltr"><div class="backdropContainer"></div><div class="skinHeader"></div>'
+                f'<script defer="defer" src="main.jellyfin.bundle.js?{_hash(rng, 12)}"></script></body></html>')
+
+    for number in range(chunks):
+        name = CHUNK_NAMES[number] if number < len(CHUNK_NAMES) else str(rng.randint(10000, 99999))
+        # Most chunks are small, a few are large
+        code(f'{name}.{_hash(rng)}.chunk.js', int(rng.lognormvariate(8.5, 1.2)) + 200)
+
+    for asset in ASSET_NAMES:
+        stem, extension = os.path.splitext(asset)
+        _writeBinary(os.path.join(webDirectory, f'{stem}.{_hash(rng)}{extension}'), rng, rng.randint(2, 64) * 1024)
+    for number in range(16):
+        _writeBinary(os.path.join(webDirectory, 'favicons', f'favicon-{number}.png'), rng, rng.randint(1, 16) * 1024)
+
+    files = 0
+    size = 0
+    for root, _, filenames in os.walk(webDirectory):
+        for filename in filenames:
+            files += 1
+            size += os.path.getsize(os.path.join(root, filename))
+    return files, size
+
+
+def generateSources(workDirectory, config, seed):
+    """Create every source of the copy rules that doesn't exist yet (files and small directories)."""
+    rng = random.Random(seed)
+    for copyRule in config.get('copy_rules', []):
+        for source in copyRule.get('sources', []):
+            path = os.path.join(workDirectory, source['source'] if isinstance(source, dict) else source)
+            if os.path.exists(path) or any(token in path for token in ('*', '?', '[')):
+                continue
+            if os.path.splitext(path)[1]:
+                _writeBinary(path, rng, rng.randint(4, 256) * 1024)
+            else:
+                for number in range(rng.randint(3, 12)):
+                    _writeBinary(os.path.join(path, f'file-{number}.{rng.choice(("png", "js", "css", "html"))}'), rng, rng.randint(1, 128) * 1024)
+
+
+# MARK: Run benchmark
+def runScript(script, configPath, scriptArgs, workDirectory, logPath):
+    """Run the customization script once and measure wall time, CPU time, peak RSS and file system events."""
+    counterDirectory = tempfile.mkdtemp(prefix='counters-', dir=workDirectory)
+    env = dict(os.environ, BENCH_COUNTERS_DIR=counterDirectory, PYTHONDONTWRITEBYTECODE='1')
+    command = [sys.executable, '-c', BOOTSTRAP, script, configPath] + scriptArgs
+
+    with open(logPath, 'w', encoding='utf-8') as log:
+        start = time.perf_counter()
+        process = subprocess.Popen(command, cwd=workDirectory, env=env, stdout=log, stderr=subprocess.STDOUT)
+        if hasattr(os, 'wait4'):
+            _, status, usage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+        else:  # Windows: no resource usage of the child
+            process.wait()
+            usage = None
+        wall = time.perf_counter() - start
+
+    run = {"wall": round(wall, 4), "exitCode": process.returncode}
+    if usage is not None:
+        # ru_maxrss is in KiB on Linux, in bytes on macOS
+        run.update(user=round(usage.ru_utime, 4), sys=round(usage.ru_stime, 4),
+                   maxRssKb=usage.ru_maxrss // 1024 if sys.platform == 'darwin' else usage.ru_maxrss)
+
+    # Sum the counters of the main process and its workers
+    events = {}
+    io = {}
+    processes = 0
+    for filename in os.listdir(counterDirectory):
+        with open(os.path.join(counterDirectory, filename), 'r') as f:
+            data = json.load(f)
+        processes += 1
+        for key, value in data['events'].items():
+            events[key] = events.get(key, 0) + value
+        for key, value in data.get('io', {}).items():
+            io[key] = io.get(key, 0) + value
+    shutil.rmtree(counterDirectory)
+
+    run.update(processes=processes, opens=events.get('open', 0),
+               dirScans=events.get('os.scandir', 0) + events.get('os.listdir', 0),
+               events=dict(sorted(events.items())))
+    if io:
+        run.update(readSyscalls=io.get('syscr'), writeSyscalls=io.get('syscw'), io=io)
+
+    with open(logPath, 'r', encoding='utf-8', errors='replace') as log:
+        output = ANSI_ESCAPE.sub('', log.read())
+    run['summary'] = {key: int(match.group(1)) for key, pattern in SUMMARY_PATTERNS.items() if (match := pattern.search(output))}
+    return run
+
+
+def summarize(runs):
+    """Return the median of every numeric metric over the runs of a scenario."""
+    keys = [key for key, value in runs[0].items() if isinstance(value, (int, float)) and key != 'exitCode']
+    return {key: statistics.median(run[key] for run in runs) for key in keys if all(run.get(key) is not None for run in runs)}
+
+
+def runBenchmark(args):
+    """Generate the trees and run all scenarios, returns the report."""
+    script = os.path.abspath(args.script)
+    with open(args.config, 'r', encoding='utf-8') as f:
+        config = yaml.safe_load(f)
+
+    workDirectory = os.path.abspath(args.workdir) if args.workdir else tempfile.mkdtemp(prefix='bench-webui-')
+    os.makedirs(workDirectory, exist_ok=True)
+    config['destination_directory'] = './web'
+    configPath = os.path.join(workDirectory, 'config-bench.yaml')
+    with open(configPath, 'w', encoding='utf-8') as f:
+        yaml.safe_dump(config, f, sort_keys=False, allow_unicode=True)
+
+    webDirectory = os.path.join(workDirectory, 'web')
+    scriptArgs = args.script_args.split()
+    scenarios = {scenario: [] for scenario in SCENARIOS}
+    tree = {}
+    try:
+        generateSources(workDirectory, config, args.seed)
+        for iteration in range(args.repeat):
+            for scenario in SCENARIOS:
+                if scenario in ('cold', 'upgrade'):
+                    # A new release: pristine files, the upgrade gets new hashes (state files are kept)
+                    shutil.rmtree(webDirectory, ignore_errors=True)
+                    seed = args.seed + (1 if scenario == 'upgrade' else 0)
+                    files, size = generateWebTree(webDirectory, config, args.chunks, int(args.bundle_mb * 1024 * 1024), seed)
+                    tree = {"files": files, "bytes": size}
+                    if scenario == 'cold':
+                        for filename in os.listdir(workDirectory):
+                            if filename.endswith('.state.json'):
+                                os.remove(os.path.join(workDirectory, filename))
+
+                run = runScript(script, configPath, scriptArgs, workDirectory, os.path.join(workDirectory, f'{scenario}-{iteration + 1}.log'))
+                scenarios[scenario].append(run)
+                color = Colors.GREEN if run['exitCode'] == 0 else Colors.RED
+                rss = f", {run['maxRssKb'] / 1024:.1f} MiB peak RSS" if 'maxRssKb' in run else ''
+                print(f"{color}{scenario} #{iteration + 1}: {run['wall']:.3f}s{rss}, {run['opens']} opens, "
+                      f"{run['dirScans']} directory scans, {run['summary']}{Colors.RESET}", file=sys.stderr)
+    finally:
+        if not args.keep and not args.workdir:
+            shutil.rmtree(workDirectory, ignore_errors=True)
+
+    return {
+        "benchmark": "customize-WebUI",
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "parameters": {"script": script, "config": os.path.abspath(args.config), "scriptArgs": scriptArgs,
+                       "chunks": args.chunks, "bundleMb": args.bundle_mb, "seed": args.seed, "repeat": args.repeat},
+        "tree": tree,
+        "scenarios": {scenario: {"median": summarize(runs), "runs": runs} for scenario, runs in scenarios.items()},
+    }
+
+
+def compareReports(report, baselinePath):
+    """Print the change of the median wall time, peak RSS and opens against an earlier report."""
+    with open(baselinePath, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    print(f"\nCompared to {baselinePath} ({baseline.get('timestamp', 'unknown')}):", file=sys.stderr)
+    for scenario in SCENARIOS:
+        old = baseline.get('scenarios', {}).get(scenario, {}).get('median', {})
+        new = report['scenarios'][scenario]['median']
+        changes = []
+        for key in ('wall', 'maxRssKb', 'opens', 'dirScans'):
+            if old.get(key) and key in new:
+                change = (new[key] - old[key]) / old[key] * 100
+                color = Colors.GREEN if change <= 0 else Colors.RED
+                changes.append(f"{key} {color}{change:+.1f}%{Colors.RESET}")
+        print(f"  {scenario}: {', '.join(changes) or 'no comparable metrics'}", file=sys.stderr)
+
+
+# MARK: Main function
+def parseArguments(argv=None):
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(description="Benchmark customize-WebUI.py on a generated Jellyfin web directory "
+                                                 "(cold run, idempotent re-run and an upgrade with new hashes).")
+    parser.add_argument('--config', default=os.path.join(BASE_DIRECTORY, 'config-Jellyfin-example.yaml'),
+                        help="configuration to benchmark, missing sources are generated (default: config-Jellyfin-example.yaml)")
+    parser.add_argument('--script', default=os.path.join(BASE_DIRECTORY, 'customize-WebUI.py'),
+                        help="customization script to run (default: customize-WebUI.py next to this file)")
+    parser.add_argument('--script-args', default='', metavar='ARGS',
+                        help="extra arguments for the script, e.g. --script-args='--state --jobs 4'")
+    parser.add_argument('--chunks', type=int, default=3000, help="number of hashed *.chunk.js files (default: 3000)")
+    parser.add_argument('--bundle-mb', type=float, default=8, metavar='MB',
+                        help="size of main.jellyfin.bundle.js in MB (default: 8)")
+    parser.add_argument('--seed', type=int, default=1, help="seed of the generated tree (default: 1)")
+    parser.add_argument('--repeat', type=int, default=3, metavar='N', help="rounds of all scenarios, medians are reported (default: 3)")
+    parser.add_argument('--workdir', help="directory for the generated trees (default: a temporary directory, removed afterwards)")
+    parser.add_argument('--keep', action='store_true', help="keep the temporary directory with the trees and logs")
+    parser.add_argument('--output', metavar='PATH', help="write the JSON report to a file instead of stdout")
+    parser.add_argument('--compare', metavar='PATH', help="compare the medians against an earlier JSON report")
+    return parser.parse_args(argv)
+
+
+def main():
+    """Main function to run the benchmark."""
+    args = parseArguments()
+    report = runBenchmark(args)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"{Colors.GREEN}Benchmark report written to {args.output}{Colors.RESET}", file=sys.stderr)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        compareReports(report, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,2987 @@
+import os
+import shutil
+import yaml
+import re
+import sys
+import json
+import time
+import errno
+import hashlib
+import argparse
+import mmap
+import fnmatch
+import threading
+import multiprocessing
+import select
+import struct
+import ctypes
+import ctypes.util
+from collections import namedtuple
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from glob import glob
+from stat import S_ISDIR, S_IMODE
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# ANSI escape sequences for colors
+class Colors:
+    CYAN = '\033[96m'
+    GREEN = '\033[92m'
+    YELLOW = '\033[93m'
+    RED = '\033[91m'
+    RESET = '\033[0m'
+
+# Color codes are stripped from messages written as JSON
+ANSI_ESCAPE = re.compile(r'\033\[[0-9;]*m')
+
+# Levels of run events: per-action details, progress, warnings, errors and the final summary
+EVENT_LEVELS = ('action', 'info', 'warning', 'error', 'summary')
+
+# Event levels shown by the console output modes (--output)
+OUTPUT_LEVELS = {
+    "verbose": EVENT_LEVELS,
+    "summary": ('info', 'warning', 'error', 'summary'),
+    "quiet": ('error',),
+}
+
+# Something that happened during a run: kind names what happened (e.g. 'copy', 'edit', 'summary'),
+# message is the console text and fields carry the structured details (paths, counts, ...)
+Event = namedtuple('Event', 'kind level message fields')
+
+# Planned change of the original content: text replacing [start, end)
+Edit = namedtuple('Edit', 'start end text')
+
+# Characters between the known byte offsets of a decoded file (regex markers on non-ASCII content)
+OFFSET_CHUNK = 64 * 1024
+
+# Version of the state manifest format used for incremental runs
+STATE_VERSION = 1
+
+# Version of the run report format (--report) and number of rules/files listed as the slowest ones
+REPORT_VERSION = 1
+PROFILE_TOP = 10
+
+# Version of the backup store manifests (--backup, --restore)
+BACKUP_VERSION = 1
+
+# Read size used when hashing file contents
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Copy backend: bounded thread pool, buffer size of the portable fallback and supported link modes
+COPY_THREADS = min(32, (os.cpu_count() or 1) + 4)
+COPY_BUFFER_SIZE = 1024 * 1024
+LINK_MODES = ('copy', 'hardlink', 'reflink')
+
+# Copy modes that synchronize existing directories (new and changed files, optionally delete removed ones)
+SYNC_MODES = ('update', 'merge')
+
+# ioctl request to clone a file copy-on-write on Linux (btrfs, xfs, ...)
+FICLONE = 0x40049409
+
+# Errors meaning "not supported here" for links, kernel-side copies and path exchanges, these fall back to plain copies and renames
+COPY_FALLBACK_ERRNOS = {getattr(errno, name) for name in ('EXDEV', 'ENOSYS', 'EINVAL', 'EOPNOTSUPP', 'ENOTSUP', 'ENOTTY',
+                                                          'EBADF', 'ENOTSOCK', 'EPERM', 'EMLINK') if hasattr(errno, name)}
+
+# renameat2() arguments to exchange two paths atomically (staged builds)
+AT_FDCWD = -100
+RENAME_EXCHANGE = 2
+
+# Destinations processed at the same time in fleet mode (--destinations)
+FLEET_THREADS = 4
+
+# Watch mode: quiet period that ends a burst of changes and scan interval of the polling fallback (seconds)
+DEBOUNCE_SECONDS = 2.0
+POLL_INTERVAL = 5.0
+
+# inotify events watched (close after write, create, delete, move) and flags of the event records
+IN_CLOSE_WRITE, IN_MOVED_FROM, IN_MOVED_TO, IN_CREATE = 0x8, 0x40, 0x80, 0x100
+IN_DELETE, IN_DELETE_SELF, IN_MOVE_SELF = 0x200, 0x400, 0x800
+IN_Q_OVERFLOW, IN_IGNORED, IN_ISDIR = 0x4000, 0x8000, 0x40000000
+INOTIFY_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+
+# Temporary files written next to their target by copies and modifications (.name.pid[.thread].tmp)
+TEMP_FILE_NAME = re.compile(r'^\..+\.\d+(\.\d+)?\.tmp$')
+
+# MARK: Events
+class ConsoleSink:
+    """Print the message of events to the console, levels selects which ones are shown."""
+
+    def __init__(self, levels=EVENT_LEVELS, stream=None):
+        self.levels = set(levels)
+        self.stream = stream
+
+    def emit(self, event):
+        if event.level in self.levels:
+            print(event.message, file=self.stream or sys.stdout)
+
+
+class JsonLinesSink:
+    """Write every event as one JSON object per line (time, kind, level, plain message and fields)."""
+
+    def __init__(self, stream=None):
+        self.stream = stream
+        self._lock = threading.Lock()
+
+    def emit(self, event):
+        record = {"time": round(time.time(), 3), "kind": event.kind, "level": event.level,
+                  "message": ANSI_ESCAPE.sub('', event.message).strip(), **event.fields}
+        with self._lock:
+            stream = self.stream or sys.stdout
+            stream.write(json.dumps(record, default=str) + '\n')
+            stream.flush()
+
+
+def createSink(output):
+    """Return the event sink of an output mode: verbose, summary, quiet or json."""
+    if output == 'json':
+        return JsonLinesSink()
+    return ConsoleSink(OUTPUT_LEVELS[output])
+
+
+# MARK: Load configuration
+def readConfig(configPath):
+    """Read a YAML configuration, raises OSError, yaml.YAMLError or ValueError (empty file)."""
+    with open(configPath, 'r', encoding='utf-8') as file:
+        config = yaml.safe_load(file)
+
+    # validate configuration
+    if not config:
+        raise ValueError("Empty configuration file")
+    return config
+
+
+def loadConfig(configPath, sink):
+    """Load YAML configuration for the command line, exits on errors."""
+    def emit(level, message):
+        sink.emit(Event('config', level, message, {"path": configPath}))
+
+    try:
+        emit('info', f"Loading configuration from {configPath} ...")
+        config = readConfig(configPath)
+        emit('info', f"{Colors.GREEN}Configuration loaded successfully.{Colors.RESET}")
+        return config
+    except FileNotFoundError:
+        emit('error', f"{Colors.RED}Error: Configuration file not found at ./{configPath}{Colors.RESET}")
+        sys.exit(1)
+    except yaml.YAMLError as e:
+        emit('error', f"{Colors.RED}Error parsing YAML configuration: {e}{Colors.RESET}")
+        sys.exit(1)
+    except ValueError as e:
+        emit('error', f"{Colors.RED}Configuration error: {e}{Colors.RESET}")
+        sys.exit(1)
+
+
+def ensureDirectory(run, path):
+    """Ensure that a directory exists (only checked in a dry run)."""
+    run.emit('action', 'directory', f"\nChecking for or creating directory: {path}", path=path)
+    if not run.dryRun and not run.statCache.isdir(path):
+        makeDirectories(run, path)
+
+
+def makeDirectories(run, path):
+    """Create a directory and its missing parents, every created one is remembered (watch mode, backups)."""
+    missing = []
+    while path and not run.statCache.exists(path):
+        missing.append(path)
+        path = os.path.dirname(path)
+    if missing:
+        os.makedirs(missing[0], exist_ok=True)
+    for directory in reversed(missing):
+        run.statCache.invalidate(directory)
+        run.wrote(directory)
+        if run.backup is not None:
+            run.backup.createdDirectory(directory)
+
+
+# MARK: Stat cache
+class StatCache:
+    """Snapshot of directory listings (one os.scandir per directory) with cached stat results.
+
+    Shared by all resolve and copy steps of a run. Paths the run writes, creates or removes are
+    invalidated explicitly, everything else is assumed to stay unchanged while the script runs.
+    """
+
+    def __init__(self):
+        self._listings = {}
+
+    def _listing(self, directory):
+        """Return {name: DirEntry | stat_result | None} of a directory, or None if it doesn't exist."""
+        directory = os.path.abspath(directory)
+        if directory not in self._listings:
+            try:
+                with os.scandir(directory) as entries:
+                    self._listings[directory] = {entry.name: entry for entry in entries}
+            except (FileNotFoundError, NotADirectoryError):
+                self._listings[directory] = None
+        return self._listings[directory]
+
+    def stat(self, path):
+        """Return the stat result of a path (following symlinks), or None if it does not exist."""
+        path = os.path.abspath(path)
+        directory, name = os.path.split(path)
+        listing = self._listing(directory) if name else None
+        if listing is None:
+            try:
+                return os.stat(path)
+            except (FileNotFoundError, NotADirectoryError):
+                return None
+
+        entry = listing.get(name)
+        if entry is False:
+            return None
+        if not isinstance(entry, os.stat_result):
+            try:
+                # Names missing in the snapshot are checked once (e.g. case-insensitive filesystems)
+                entry = entry.stat() if isinstance(entry, os.DirEntry) else os.stat(path)
+            except (FileNotFoundError, NotADirectoryError):
+                entry = False
+            listing[name] = entry
+        return entry or None
+
+    def exists(self, path):
+        return self.stat(path) is not None
+
+    def isdir(self, path):
+        stat = self.stat(path)
+        return stat is not None and S_ISDIR(stat.st_mode)
+
+    def getmtime(self, path):
+        stat = self.stat(path)
+        if stat is None:
+            raise FileNotFoundError(f"No such file or directory: '{path}'")
+        return stat.st_mtime
+
+    def glob(self, pattern):
+        """glob() for patterns with wildcards in the file name only, served from the directory snapshot."""
+        directory, namePattern = os.path.split(pattern)
+        if any(token in directory for token in ('*', '?', '[')):
+            return glob(pattern)
+
+        listing = self._listing(directory or os.curdir)
+        if listing is None:
+            return []
+        names = sorted(name for name in fnmatch.filter(listing, namePattern)
+                       if namePattern.startswith('.') or not name.startswith('.'))
+        return [os.path.join(directory, name) for name in names if self.exists(os.path.join(directory, name))]
+
+    def invalidate(self, path):
+        """Forget the cached state of a path the run has written, created or removed."""
+        path = os.path.abspath(path)
+        directory, name = os.path.split(path)
+        listing = self._listings.get(directory)
+        if listing is not None:
+            listing[name] = None
+        elif directory in self._listings:
+            # The parent did not exist when it was listed, it may have been created since
+            self.invalidate(directory)
+
+        # A replaced or removed directory loses its snapshot and the ones below it
+        for cached in [cached for cached in self._listings if cached == path or cached.startswith(path + os.sep)]:
+            del self._listings[cached]
+
+
+# MARK: Run context
+class RunContext:
+    """State of one run: counters, stat cache, options, state manifest, run report and event sink.
+
+    Every run gets its own context, so runs can follow each other or run concurrently in threads
+    without sharing counters or directory snapshots.
+    """
+
+    def __init__(self, sink=None, state=None, report=None, jobs=None, dryRun=False, sharedInputs=None):
+        self.sink = sink if sink is not None else ConsoleSink()
+        self.sharedInputs = sharedInputs
+        self.state = state
+        self.report = report
+        self.jobs = jobs
+        self.dryRun = dryRun
+        self.results = {"copies": 0, "modifications": 0, "cacheSkips": 0}
+        self.errorList = {"copies": 0, "modifications": 0, "copyWarnings": 0, "modWarnings": 0}
+        # Directory snapshots and stat results shared by the resolve and copy steps
+        self.statCache = StatCache()
+        # Absolute paths the run wrote, created or removed and directory trees it removed (see watch mode)
+        self.written = set()
+        self.removedTrees = set()
+        # Backup store of the run (--backup), files are backed up before they are replaced, removed or modified
+        self.backup = None
+
+    def emit(self, level, kind, message, **fields):
+        """Send an event to the sink."""
+        self.sink.emit(Event(kind, level, message, fields))
+
+    def wrote(self, path):
+        """Remember a path the run has written, created or removed."""
+        self.written.add(os.path.abspath(path))
+
+    def cached(self, key, compute):
+        """Return compute(), computed once for all runs sharing their inputs (fleet mode)."""
+        if self.sharedInputs is None:
+            return compute()
+        return self.sharedInputs.get(key, compute)
+
+    @property
+    def failed(self):
+        """True if any copy or modification failed."""
+        return self.errorList['copies'] > 0 or self.errorList['modifications'] > 0
+
+
+def resolveSourcePath(run, rawPath):
+    """Resolve a source path once per run (or fleet of runs)."""
+    return run.cached(('resolve', rawPath), lambda: _resolveSourcePath(run, rawPath))
+
+
+def _resolveSourcePath(run, rawPath):
+    """Resolve a source path and support glob patterns for hashed filenames."""
+    normalized = os.path.normpath(rawPath)
+
+    # Direct hit fast path
+    if run.statCache.exists(normalized):
+        return normalized
+
+    # Allow globbing when hashed suffixes change per build (e.g. banner-light.*.png)
+    if any(token in rawPath for token in ('*', '?', '[')):
+        matches = run.statCache.glob(rawPath)
+        if matches:
+            # Prefer the most recently modified match to follow the latest build output
+            matches.sort(key=run.statCache.getmtime, reverse=True)
+            chosen = os.path.normpath(matches[0])
+            if len(matches) > 1:
+                run.emit('action', 'resolve', f"Multiple matches for pattern {rawPath}, selecting newest: {chosen}", pattern=rawPath, path=chosen)
+            else:
+                run.emit('action', 'resolve', f"Resolved pattern {rawPath} -> {chosen}", pattern=rawPath, path=chosen)
+            return chosen
+        raise FileNotFoundError(f"Pattern '{rawPath}' did not match any files")
+
+    # Nothing found -> propagate missing file
+    raise FileNotFoundError(f"Source path does not exist: {rawPath}")
+
+
+def resolveTargetPath(run, rawTarget, destinationDirectory):
+    """Resolve destination path, allowing wildcard patterns to reuse hashed filenames."""
+    relativeTarget = rawTarget.lstrip('./')
+    targetPattern = os.path.normpath(os.path.join(destinationDirectory, relativeTarget))
+
+    if any(token in relativeTarget for token in ('*', '?', '[')):
+        matches = run.statCache.glob(targetPattern)
+        if matches:
+            matches.sort(key=run.statCache.getmtime, reverse=True)
+            chosen = os.path.normpath(matches[0])
+            if len(matches) > 1:
+                run.emit('action', 'resolve', f"Multiple destination matches for {rawTarget}, selecting newest: {chosen}", pattern=rawTarget, path=chosen)
+            else:
+                run.emit('action', 'resolve', f"Resolved destination pattern {rawTarget} -> {chosen}", pattern=rawTarget, path=chosen)
+            return chosen
+
+        sanitizedName = re.sub(r'[\*\?\[\]]', '', os.path.basename(relativeTarget))
+        fallback = os.path.normpath(os.path.join(os.path.dirname(targetPattern), sanitizedName))
+        run.emit('action', 'resolve', f"No existing destination matched {rawTarget}, using fallback: {fallback}", pattern=rawTarget, path=fallback)
+        return fallback
+
+    return targetPattern
+
+
+# MARK: Run state
+def defaultStatePath(configPath):
+    """Return the default state manifest location (next to the config file)."""
+    return os.path.splitext(configPath)[0] + '.state.json'
+
+
+def newState():
+    """Return an empty state manifest."""
+    return {"version": STATE_VERSION, "copies": {}, "files": {}, "anchors": {}}
+
+
+def loadState(run, statePath):
+    """Load the state manifest of the previous run, or start with an empty one."""
+    try:
+        with open(statePath, 'r', encoding='utf-8') as file:
+            state = json.load(file)
+    except FileNotFoundError:
+        return newState()
+    except (OSError, ValueError) as e:
+        run.emit('warning', 'state', f"{Colors.YELLOW}Ignoring unreadable state manifest {statePath}: {e}{Colors.RESET}", path=statePath)
+        return newState()
+
+    if not isinstance(state, dict) or state.get('version') != STATE_VERSION:
+        run.emit('warning', 'state', f"{Colors.YELLOW}Ignoring state manifest {statePath} written by another version.{Colors.RESET}", path=statePath)
+        return newState()
+    state.setdefault('copies', {})
+    state.setdefault('files', {})
+    state.setdefault('anchors', {})
+    return state
+
+
+def saveState(state, statePath):
+    """Write the state manifest atomically."""
+    tempPath = statePath + '.tmp'
+    with open(tempPath, 'w', encoding='utf-8') as file:
+        json.dump(state, file, indent=1, sort_keys=True)
+    os.replace(tempPath, statePath)
+
+
+def fingerprint(value):
+    """Return a stable hash of a (JSON serializable) rule definition."""
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def hashFile(path):
+    """Return the SHA-256 hex digest of a file's content."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def statSignature(run, path):
+    """Return [size, mtime_ns] for a file, or a combined signature for a directory tree (stat only, no reads)."""
+    if not run.statCache.isdir(path):
+        stat = run.statCache.stat(path)
+        if stat is None:
+            raise FileNotFoundError(f"No such file or directory: '{path}'")
+        return [stat.st_size, stat.st_mtime_ns]
+
+    files, _ = _scanTree(path)
+    return fingerprint(sorted((relPath, stat.st_size, stat.st_mtime_ns) for relPath, stat in files.items()))
+
+
+# MARK: Copy sources
+def _copySignature(run, rule, source, sourcePath, targetPath):
+    """Describe a copy entry by its rule definition and the current state of source and target.
+
+    The fingerprint covers every option of the rule (mode, link_mode, delete, ...) and the entry's
+    own source, so editing another source of the same rule keeps the entry cached.
+    """
+    options = {key: value for key, value in rule.items() if key != 'sources'}
+    return {
+        "rule": fingerprint({"options": options, "source": source}),
+        "source": sourcePath,
+        "sourceSignature": run.cached(('signature', sourcePath), lambda: statSignature(run, sourcePath)),
+        "target": targetPath,
+        "targetSignature": statSignature(run, targetPath),
+    }
+
+
+def _formatSize(size):
+    """Format a byte count for the console output."""
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+def _copyFileData(sourceFile, targetFile):
+    """Copy the file data kernel-side (copy_file_range, then sendfile), falling back to a buffered copy.
+
+    Returns the name of the method that was used.
+    """
+    sourceFd, targetFd = sourceFile.fileno(), targetFile.fileno()
+    size = os.fstat(sourceFd).st_size
+    for method in ('copy_file_range', 'sendfile'):
+        if not hasattr(os, method):
+            continue
+        copied = 0
+        try:
+            while copied < size:
+                if method == 'copy_file_range':
+                    sent = os.copy_file_range(sourceFd, targetFd, size - copied)
+                else:
+                    sent = os.sendfile(targetFd, sourceFd, copied, size - copied)
+                if sent == 0:
+                    break
+                copied += sent
+        except OSError as e:
+            # Only fall back if nothing was written yet and the filesystem does not support the method
+            if copied or e.errno not in COPY_FALLBACK_ERRNOS:
+                raise
+            continue
+        if copied == size:
+            return method
+        # The call stopped early (unsupported by the filesystem or a shrinking source), copy the rest buffered
+        sourceFile.seek(copied)
+        targetFile.seek(copied)
+        break
+
+    shutil.copyfileobj(sourceFile, targetFile, COPY_BUFFER_SIZE)
+    return 'buffered'
+
+
+def _reflink(sourceFile, targetFile):
+    """Clone the file data copy-on-write (FICLONE), raises OSError if the filesystem can't."""
+    if fcntl is None or not sys.platform.startswith('linux'):
+        raise OSError(errno.EOPNOTSUPP, "Reflinks are not supported on this platform")
+    fcntl.ioctl(targetFile.fileno(), FICLONE, sourceFile.fileno())
+
+
+def copyFile(sourcePath, targetPath, linkMode='copy'):
+    """Copy a file with its metadata into a temporary file that is renamed over the target.
+
+    linkMode 'hardlink' or 'reflink' shares the data with the source where the filesystem supports it
+    and falls back to a regular copy otherwise. Returns (size, method).
+    """
+    size = os.path.getsize(sourcePath)
+    tempPath = os.path.join(os.path.dirname(targetPath), f".{os.path.basename(targetPath)}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        if linkMode == 'hardlink':
+            if os.path.lexists(targetPath) and os.path.samefile(sourcePath, targetPath):
+                return size, 'hardlink'
+            try:
+                os.link(sourcePath, tempPath)
+                os.replace(tempPath, targetPath)
+                return size, 'hardlink'
+            except OSError as e:
+                if e.errno not in COPY_FALLBACK_ERRNOS:
+                    raise
+
+        with open(sourcePath, 'rb') as sourceFile, open(tempPath, 'wb') as targetFile:
+            method = None
+            if linkMode == 'reflink':
+                try:
+                    _reflink(sourceFile, targetFile)
+                    method = 'reflink'
+                except OSError as e:
+                    if e.errno not in COPY_FALLBACK_ERRNOS:
+                        raise
+            if method is None:
+                method = _copyFileData(sourceFile, targetFile)
+
+        shutil.copystat(sourcePath, tempPath)
+        os.replace(tempPath, targetPath)
+        return size, method
+    finally:
+        if os.path.lexists(tempPath):
+            os.remove(tempPath)
+
+
+def _collectTreeJobs(run, sourcePath, targetPath, onlyMissing=False):
+    """Create the directory structure of a source tree and return its file copy jobs and directory pairs."""
+    jobs = []
+    directories = []
+    for rootDir, _, files in os.walk(sourcePath, followlinks=True):
+        relRoot = os.path.relpath(rootDir, sourcePath)
+        destRoot = targetPath if relRoot == '.' else os.path.join(targetPath, relRoot)
+        if not run.dryRun and not run.statCache.isdir(destRoot):
+            makeDirectories(run, destRoot)
+        directories.append((rootDir, destRoot))
+        for fname in files:
+            destFile = os.path.join(destRoot, fname)
+            if onlyMissing and run.statCache.exists(destFile):
+                continue
+            jobs.append((os.path.join(rootDir, fname), destFile))
+    return jobs, directories
+
+
+def _scanTree(root):
+    """Return ({relative file path: stat}, [relative directory paths]) of a tree, using os.scandir."""
+    files = {}
+    directories = []
+    pending = ['']
+    while pending:
+        relDir = pending.pop()
+        with os.scandir(os.path.join(root, relDir) if relDir else root) as entries:
+            for entry in entries:
+                relPath = os.path.join(relDir, entry.name) if relDir else entry.name
+                if entry.is_dir():
+                    directories.append(relPath)
+                    pending.append(relPath)
+                elif entry.is_file():
+                    files[relPath] = entry.stat()
+    return files, directories
+
+
+def _collectSyncJobs(run, sourcePath, targetPath, delete=False):
+    """Compare a source tree with its target, returns (copy jobs, unchanged count, removed count).
+
+    Files are hashed only if their sizes match but their mtimes differ. With delete, target files
+    missing in the source are removed. A dry run changes nothing.
+    """
+    sourceFiles, sourceDirs = run.cached(('tree', sourcePath), lambda: _scanTree(sourcePath))
+    targetFiles, targetDirs = _scanTree(targetPath)
+
+    for relDir in sorted(set(sourceDirs) - set(targetDirs)):
+        if run.dryRun:
+            break
+        makeDirectories(run, os.path.join(targetPath, relDir))
+
+    jobs = []
+    unchanged = 0
+    for relPath, sourceStat in sorted(sourceFiles.items()):
+        sourceFile = os.path.join(sourcePath, relPath)
+        targetFile = os.path.join(targetPath, relPath)
+        targetStat = targetFiles.get(relPath)
+        if targetStat is not None and targetStat.st_size == sourceStat.st_size:
+            if targetStat.st_mtime_ns == sourceStat.st_mtime_ns:
+                unchanged += 1
+                continue
+            if run.cached(('hash', sourceFile), lambda: hashFile(sourceFile)) == hashFile(targetFile):
+                # Same content: align the mtime, so the next run can decide by stat alone
+                if not run.dryRun:
+                    if targetStat.st_nlink > 1:
+                        # Shared with another tree (e.g. the live files of a staged run), replace it instead of touching the inode
+                        copyFile(sourceFile, targetFile)
+                    else:
+                        os.utime(targetFile, ns=(sourceStat.st_atime_ns, sourceStat.st_mtime_ns))
+                    run.statCache.invalidate(targetFile)
+                    run.wrote(targetFile)
+                unchanged += 1
+                continue
+        jobs.append((sourceFile, targetFile))
+
+    removed = 0
+    if delete and run.dryRun:
+        removed = len(set(targetFiles) - set(sourceFiles))
+    elif delete:
+        for relPath in sorted(set(targetFiles) - set(sourceFiles)):
+            if run.backup is not None:
+                run.backup.removing(os.path.join(targetPath, relPath))
+            os.remove(os.path.join(targetPath, relPath))
+            run.statCache.invalidate(os.path.join(targetPath, relPath))
+            run.wrote(os.path.join(targetPath, relPath))
+            removed += 1
+        for relDir in sorted(set(targetDirs) - set(sourceDirs), key=len, reverse=True):
+            try:
+                os.rmdir(os.path.join(targetPath, relDir))
+                run.statCache.invalidate(os.path.join(targetPath, relDir))
+                run.wrote(os.path.join(targetPath, relDir))
+            except OSError:
+                pass  # not empty, e.g. symlinks or other non-regular files
+
+    return jobs, unchanged, removed
+
+
+def _pathsOverlap(path, otherPaths):
+    """Return True if path equals, contains or lies inside one of the other paths."""
+    for other in otherPaths:
+        if path == other or path.startswith(other + os.sep) or other.startswith(path + os.sep):
+            return True
+    return False
+
+
+def _underAny(path, paths):
+    """Return True if path equals or lies inside one of the paths (a set of absolute paths)."""
+    while path not in paths:
+        parent = os.path.dirname(path)
+        if parent == path:
+            return False
+        path = parent
+    return True
+
+
+def _staticPrefix(path):
+    """Cut a path pattern before its first component with wildcards."""
+    while any(token in path for token in ('*', '?', '[')):
+        path = os.path.dirname(path)
+    return path or os.curdir
+
+
+def _patternOverlaps(pattern, paths):
+    """Return True if one of the paths matches, contains or lies inside a path pattern (wildcards allowed)."""
+    prefix = _staticPrefix(pattern)
+    if prefix == pattern:
+        return _pathsOverlap(pattern, paths)
+    return any(fnmatch.fnmatchcase(path, pattern) or fnmatch.fnmatchcase(path, os.path.join(pattern, '*')) or _underAny(prefix, {path})
+               for path in paths)
+
+
+def _copyRulePaths(rule, destinationDirectory):
+    """Return the absolute (source, target) path patterns a copy rule reads and writes."""
+    paths = []
+    for source in rule.get('sources', []):
+        if isinstance(source, dict):
+            sourcePath = source.get('source', '')
+            targetPath = os.path.join(destinationDirectory, source.get('target', '').lstrip('./'))
+        else:
+            sourcePath = source
+            targetPath = os.path.join(destinationDirectory, os.path.basename(os.path.normpath(source)))
+        paths.append((os.path.abspath(sourcePath), os.path.abspath(targetPath)))
+    return paths
+
+
+def _timedCopyFile(sourcePath, targetPath, linkMode):
+    """Copy a file like copyFile, returns (size, method, seconds)."""
+    start = time.perf_counter()
+    size, method = copyFile(sourcePath, targetPath, linkMode)
+    return size, method, time.perf_counter() - start
+
+
+def _flushCopyEntries(run, executor, entries, linkMode, ruleStats, seenCopies):
+    """Run the copy jobs of all pending entries on the thread pool and settle every entry.
+
+    In a dry run the jobs are only counted, their size is taken from the source.
+    """
+    jobs = [(entry, sourceFile, targetFile) for entry in entries for sourceFile, targetFile in entry['jobs']]
+    backups = {}
+    if not run.dryRun:
+        # Replaced files are backed up before any copy starts
+        if run.backup is not None:
+            for index, (_, _, targetFile) in enumerate(jobs):
+                try:
+                    backups[index] = run.backup.replacing(targetFile)
+                except OSError as e:
+                    run.emit('warning', 'backup', f"{Colors.YELLOW}Could not back up {targetFile}: {e}{Colors.RESET}", path=targetFile)
+                    run.errorList['copyWarnings'] += 1
+        futures = [executor.submit(_timedCopyFile, sourceFile, targetFile, linkMode) for _, sourceFile, targetFile in jobs]
+
+    failures = {}
+    for index, (entry, sourceFile, targetFile) in enumerate(jobs):
+        try:
+            if run.dryRun:
+                size, method, seconds = run.statCache.stat(sourceFile).st_size, linkMode, 0.0
+            else:
+                run.statCache.invalidate(targetFile)
+                size, method, seconds = futures[index].result()
+                run.wrote(targetFile)
+                if index in backups:
+                    backups[index]['after'] = run.cached(('hash', sourceFile), lambda: hashFile(sourceFile))
+                    run.backup.add(backups[index])
+        except OSError as e:
+            failures.setdefault(id(entry), e)
+            continue
+        shared = method in ('hardlink', 'reflink')
+        ruleStats['files'] += 1
+        ruleStats['shared' if shared else 'bytes'] += size
+        entry['bytes'] += 0 if shared else size
+        entry['seconds'] += seconds
+
+    for entry in entries:
+        error = failures.get(id(entry))
+        if run.report is not None:
+            run.report['files'].append({"phase": "copy", "rule": entry['rule'], "path": entry['target'], "source": entry['source'],
+                                    "decision": "error" if error is not None else entry['decision'], "files": len(entry['jobs']),
+                                    "removed": entry['removed'], "bytesRead": entry['bytes'], "bytesWritten": entry['bytes'],
+                                    "seconds": entry['seconds']})
+        if isinstance(error, PermissionError):
+            run.emit('error', 'copy', f"\n{Colors.RED}Error: Permission denied when copying {entry['source']}{Colors.RESET}", source=entry['source'], target=entry['target'])
+            run.errorList["copies"] += 1
+            continue
+        if error is not None:
+            run.emit('error', 'copy', f"{Colors.RED}Error copying {entry['source']}: {error}{Colors.RESET}", source=entry['source'], target=entry['target'])
+            run.errorList["copies"] += 1
+            continue
+        run.results['copies'] += entry['copies']
+        if run.dryRun:
+            continue
+
+        # Freshly copied trees get the directory metadata of the source, like copytree
+        for sourceDir, targetDir in reversed(entry['directories']):
+            try:
+                shutil.copystat(sourceDir, targetDir)
+                run.statCache.invalidate(targetDir)
+            except OSError:
+                pass
+
+        # Remember the outcome for the next run
+        if run.state is not None and entry['record'] is not None and run.statCache.exists(entry['target']):
+            cacheKey, rule, source = entry['record']
+            seenCopies[cacheKey] = _copySignature(run, rule, source, entry['source'], entry['target'])
+    entries.clear()
+
+
+def copySources(run, config, destinationDirectory, changedPaths=None):
+    """Copy files and folders according to copy rules.
+
+    With changedPaths (absolute paths) only the rules whose sources or targets touch one of them run.
+    """
+    run.emit('info', 'phase', f"{Colors.YELLOW}Starting source file & folder copy and replace process...{Colors.RESET}", phase='copy')
+    cachedCopies = run.state['copies'] if run.state is not None else {}
+    seenCopies = {}
+
+    def skipped(ruleNumber, sourcePath, targetPath, decision):
+        if run.report is not None:
+            run.report['files'].append({"phase": "copy", "rule": ruleNumber, "path": targetPath, "source": sourcePath,
+                                    "decision": decision, "files": 0, "removed": 0, "bytesRead": 0, "bytesWritten": 0, "seconds": 0.0})
+    executor = ThreadPoolExecutor(max_workers=COPY_THREADS)
+    for ruleIndex, rule in enumerate(config.get('copy_rules', [])):
+        if changedPaths is not None and not any(_patternOverlaps(pattern, changedPaths) for pair in _copyRulePaths(rule, destinationDirectory) for pattern in pair):
+            seenCopies.update((cacheKey, copy) for cacheKey, copy in cachedCopies.items() if cacheKey.startswith(f"{ruleIndex}:"))
+            continue
+
+        mode = rule.get('mode')
+        linkMode = rule.get('link_mode', 'copy')
+        if linkMode not in LINK_MODES:
+            run.emit('error', 'config', f"\n{Colors.RED}Configuration error: unknown link_mode '{linkMode}', using 'copy'{Colors.RESET}", rule=ruleIndex + 1)
+            run.errorList["copies"] += 1
+            linkMode = 'copy'
+
+        # Entries are collected and their copy jobs run in parallel until an entry depends on a pending one
+        pendingEntries = []
+        ruleStats = {"files": 0, "bytes": 0, "shared": 0, "cacheSkips": 0}
+        ruleStart = time.perf_counter()
+        for source in rule.get('sources', []):
+            sourcePath = source.get('source') if isinstance(source, dict) else source
+            cacheKey = f"{ruleIndex}:{fingerprint(source)}"
+            try:
+                # Wildcards may resolve to files a pending entry is about to create
+                rawPaths = [source.get('source', ''), source.get('target', '')] if isinstance(source, dict) else [source]
+                if any(token in rawPath for rawPath in rawPaths for token in ('*', '?', '[')):
+                    _flushCopyEntries(run, executor, pendingEntries, linkMode, ruleStats, seenCopies)
+
+                # Distinguish between sources with explicit target and without
+                if isinstance(source, dict):
+                    sourcePath = resolveSourcePath(run, source['source'])
+
+                    checkTargetPath = source['target']
+
+                    # Check for absolute paths in target and correct them if necessary
+                    if os.path.isabs(checkTargetPath):
+                        corrected = os.path.normpath(os.path.join(destinationDirectory, checkTargetPath.lstrip('./')))
+                        raise ValueError(f"{Colors.RED}Absolute path incorrect: {Colors.YELLOW}Corrected {checkTargetPath} to {corrected}.{Colors.RESET}")
+
+                    targetPath = resolveTargetPath(run, checkTargetPath, destinationDirectory)
+
+
+                else:
+                    sourcePath = resolveSourcePath(run, source)
+                    if run.statCache.isdir(sourcePath):
+                        targetPath = os.path.normpath(os.path.join(destinationDirectory, os.path.basename(sourcePath)))
+                    else:
+                        targetPath = resolveTargetPath(run, os.path.basename(sourcePath), destinationDirectory)
+
+                    # Check if source exists
+                    if not run.statCache.exists(sourcePath):
+                        raise FileNotFoundError(f"Source path does not exist: {sourcePath}")
+
+                # Entries touching the target or source of a pending entry have to wait for it
+                pendingTargets = [entry['target'] for entry in pendingEntries]
+                if _pathsOverlap(targetPath, pendingTargets) or _pathsOverlap(sourcePath, pendingTargets):
+                    _flushCopyEntries(run, executor, pendingEntries, linkMode, ruleStats, seenCopies)
+
+                # Skip entries whose rule, source and target did not change since the last run
+                if cacheKey in cachedCopies and run.statCache.exists(targetPath):
+                    copySignature = _copySignature(run, rule, source, sourcePath, targetPath)
+                    if cachedCopies[cacheKey] == copySignature:
+                        run.emit('action', 'copy.skip', f"Skipping {sourcePath} -> {targetPath}: unchanged since last run (cached)", source=sourcePath, target=targetPath, reason='cached')
+                        run.results['cacheSkips'] += 1
+                        ruleStats['cacheSkips'] += 1
+                        seenCopies[cacheKey] = copySignature
+                        skipped(ruleIndex + 1, sourcePath, targetPath, 'cached')
+                        continue
+
+                # Create target directory
+                ensureDirectory(run, os.path.dirname(targetPath))
+
+                # Copy or replace mode
+                replacing = False
+                removedTarget = False
+                if mode == 'replace' and run.statCache.exists(targetPath):
+                    run.emit('action', 'replace', f"Replacing existing file/folder: {targetPath}", target=targetPath)
+
+                    # Directories are removed, files are replaced atomically by the copy
+                    if run.statCache.isdir(targetPath):
+                        if not run.dryRun:
+                            if run.backup is not None:
+                                run.backup.removing(targetPath)
+                            shutil.rmtree(targetPath)
+                            run.statCache.invalidate(targetPath)
+                            run.removedTrees.add(os.path.abspath(targetPath))
+                        removedTarget = True
+                    else:
+                        replacing = True
+
+                # Update mode: files are copied if the source is newer, directories are synchronized below
+                if mode == 'update' and run.statCache.exists(targetPath):
+                    if not run.statCache.isdir(sourcePath):
+                        run.emit('action', 'update', f"Checking if {sourcePath} is newer than {targetPath}", source=sourcePath, target=targetPath)
+                        srcMtime = run.statCache.getmtime(sourcePath)
+                        destMtime = run.statCache.getmtime(targetPath)
+                        if srcMtime <= destMtime:
+                            run.emit('action', 'copy.skip', f"{Colors.YELLOW}Skipping {sourcePath}: Destination is up to date{Colors.RESET}", source=sourcePath, target=targetPath, reason='up to date')
+                            skipped(ruleIndex + 1, sourcePath, targetPath, 'up to date')
+                            continue   # Skip this source file, the other sources of the rule are still checked
+                        replacing = True
+                elif mode != 'update' and not run.statCache.exists(sourcePath):
+                    run.emit('warning', 'copy', f"{Colors.YELLOW}Should update {sourcePath} to {targetPath}, but {sourcePath} is not (yet) existing.{Colors.RESET}", source=sourcePath, target=targetPath)
+
+                entry = {"source": sourcePath, "target": targetPath, "jobs": [], "directories": [], "copies": 0,
+                         "record": (cacheKey, rule, source), "rule": ruleIndex + 1, "decision": "skip", "removed": 0,
+                         "bytes": 0, "seconds": 0.0}
+
+                # Copy files or directories
+                if run.statCache.isdir(sourcePath):
+                    if removedTarget or not run.statCache.exists(targetPath):
+                        run.emit('action', 'copy', f"{Colors.GREEN}Copying directory: {sourcePath} -> {targetPath}{Colors.RESET}", source=sourcePath, target=targetPath)
+                        entry['jobs'], entry['directories'] = _collectTreeJobs(run, sourcePath, targetPath)
+                        entry['copies'] = 1
+                    else:
+                        if mode == 'replace':
+                            # handled earlier
+                            run.emit('warning', 'copy', f"{Colors.YELLOW}Unexpected existing directory in replace mode (already handled): {targetPath}{Colors.RESET}", target=targetPath)
+                            run.errorList['copyWarnings'] += 1
+                        elif mode in SYNC_MODES:
+                            run.emit('action', 'sync', f"Synchronizing directory: {sourcePath} -> {targetPath}", source=sourcePath, target=targetPath)
+                            entry['jobs'], unchanged, removed = _collectSyncJobs(run, sourcePath, targetPath, rule.get('delete', False))
+                            changed = len(entry['jobs'])
+                            if changed or removed:
+                                run.emit('action', 'copy', f"{Colors.GREEN}Copying {changed} new or changed file(s), removed {removed} file(s), {unchanged} unchanged: {targetPath}{Colors.RESET}",
+                                         source=sourcePath, target=targetPath, files=changed, removed=removed, unchanged=unchanged)
+                                entry['copies'] = changed
+                                entry['removed'] = removed
+                            else:
+                                run.emit('action', 'copy.skip', f"{Colors.YELLOW}Directory already up to date ({unchanged} unchanged file(s)): {targetPath}{Colors.RESET}",
+                                         source=sourcePath, target=targetPath, reason='up to date')
+                                run.errorList['copyWarnings'] += 1
+                        elif mode == 'copy':
+                            entry['jobs'], _ = _collectTreeJobs(run, sourcePath, targetPath, onlyMissing=True)
+                            added = len(entry['jobs'])
+                            if added:
+                                run.emit('action', 'copy', f"{Colors.GREEN}Adding {added} new file(s) into existing directory (copy merge behavior): {targetPath}{Colors.RESET}",
+                                         source=sourcePath, target=targetPath, files=added)
+                                entry['copies'] = added
+                            else:
+                                run.emit('action', 'copy.skip', f"{Colors.YELLOW}Directory already up to date (no new files): {targetPath}{Colors.RESET}",
+                                         source=sourcePath, target=targetPath, reason='exists')
+                                run.errorList['copyWarnings'] += 1
+                        else:
+                            run.emit('action', 'copy.skip', f"{Colors.YELLOW}Skipping directory copy (mode {mode}): already exists {targetPath}{Colors.RESET}",
+                                     source=sourcePath, target=targetPath, reason='exists')
+                            run.errorList['copyWarnings'] += 1
+                else:
+                    if replacing or not run.statCache.exists(targetPath):
+                        run.emit('action', 'copy', f"{Colors.GREEN}Copying file: {sourcePath} -> {targetPath}{Colors.RESET}", source=sourcePath, target=targetPath)
+                        entry['jobs'] = [(sourcePath, targetPath)]
+                        entry['copies'] = 1
+                    else:
+                        run.emit('action', 'copy.skip', f"{Colors.YELLOW}Skipping file copy: {sourcePath} -> {targetPath} (already exists){Colors.RESET}",
+                                 source=sourcePath, target=targetPath, reason='exists')
+                        run.errorList['copyWarnings'] += 1
+
+                if entry['jobs'] or entry['removed']:
+                    entry['decision'] = 'copy'
+                pendingEntries.append(entry)
+
+            except FileNotFoundError as e:
+                run.emit('error', 'copy', f"\n{Colors.RED}Error: {e}{Colors.RESET}", source=sourcePath)
+                run.errorList["copies"] += 1
+                skipped(ruleIndex + 1, sourcePath, None, 'error')
+                continue
+
+            except ValueError as e:
+                run.emit('error', 'config', f"\n{Colors.RED}Configuration error: {e}{Colors.RESET}", source=sourcePath)
+                run.errorList["copies"] += 1
+                skipped(ruleIndex + 1, sourcePath, None, 'error')
+                continue
+
+            except PermissionError:
+                run.emit('error', 'copy', f"\n{Colors.RED}Error: Permission denied when copying {sourcePath}{Colors.RESET}", source=sourcePath)
+                run.errorList["copies"] += 1
+                skipped(ruleIndex + 1, sourcePath, None, 'error')
+                continue
+
+            except OSError as e:
+                run.emit('error', 'copy', f"{Colors.RED}Error copying {sourcePath}: {e}{Colors.RESET}", source=sourcePath)
+                run.errorList["copies"] += 1
+                skipped(ruleIndex + 1, sourcePath, None, 'error')
+                continue
+
+        _flushCopyEntries(run, executor, pendingEntries, linkMode, ruleStats, seenCopies)
+
+        # Report the amount of data and the throughput per rule
+        elapsed = max(time.perf_counter() - ruleStart, 1e-6)
+        if run.report is not None:
+            run.report['copyRules'].append({"rule": ruleIndex + 1, "mode": mode, "linkMode": linkMode, "files": ruleStats['files'],
+                                        "bytes": ruleStats['bytes'], "shared": ruleStats['shared'],
+                                        "cacheSkips": ruleStats['cacheSkips'], "seconds": elapsed})
+        if ruleStats['files'] and not run.dryRun:
+            shared = f", {_formatSize(ruleStats['shared'])} shared via {linkMode}" if ruleStats['shared'] else ''
+            run.emit('info', 'copy.rule', f"{Colors.CYAN}Copy rule #{ruleIndex + 1}: {ruleStats['files']} file(s), {_formatSize(ruleStats['bytes'])} copied{shared} "
+                     f"in {elapsed:.2f}s ({_formatSize((ruleStats['bytes'] + ruleStats['shared']) / elapsed)}/s){Colors.RESET}",
+                     rule=ruleIndex + 1, files=ruleStats['files'], bytes=ruleStats['bytes'], shared=ruleStats['shared'], seconds=elapsed)
+
+    executor.shutdown()
+
+    if run.state is not None:
+        run.state['copies'] = seenCopies
+
+    run.emit('info', 'phase', f"\n{Colors.GREEN}Source file & folder copy/replace process completed{Colors.RESET} with {Colors.RED}{run.errorList['copies']} errors{Colors.RESET} and {Colors.YELLOW}{run.errorList['copyWarnings']} warnings{Colors.RESET}.\n",
+             phase='copy', errors=run.errorList['copies'], warnings=run.errorList['copyWarnings'])
+
+
+# MARK: Modify files
+def _is_regex(marker: str) -> bool:
+    """Return True if the marker is flagged as regex (prefix 're:')."""
+    return isinstance(marker, str) and marker.startswith('re:')
+
+
+def _extract_pattern(marker: str) -> str:
+    """Strip the 're:' prefix and return the regex pattern."""
+    return marker[3:]
+
+
+def _compileEdit(action, marker, text):
+    """Compile one insert/replace marker, regex markers are compiled once (DOTALL).
+
+    Replacements are searched with DOTALL but applied without it (replaceRegex), like re.search/re.subn.
+    """
+    edit = {"action": action, "text": text, "data": text.encode('utf-8')}
+    if _is_regex(marker):
+        pattern = _extract_pattern(marker)
+        edit.update(anchor=pattern, needle=None, regex=re.compile(pattern, re.DOTALL))
+        if action == 'replace':
+            edit.update(replaceRegex=re.compile(pattern))
+    else:
+        edit.update(anchor=marker, needle=marker.encode('utf-8'), regex=None)
+    return edit
+
+
+def compileModificationRules(run, config):
+    """Compile the file patterns and markers of all modification rules once."""
+    compiledRules = []
+    for number, rule in enumerate(config.get('modification_rules', []), start=1):
+        filePattern = rule.get('file_pattern', '*')
+        try:
+            edits = []
+            for insertRule in rule.get('insert_rules', []):
+                insert_text = insertRule['insert_text'].replace('\n', '')
+                if 'after_text' in insertRule:
+                    edits.append(_compileEdit('after', insertRule['after_text'], insert_text))
+                if 'before_text' in insertRule:
+                    edits.append(_compileEdit('before', insertRule['before_text'], insert_text))
+            for replaceRule in rule.get('replace_rules', []):
+                if 'old_text' in replaceRule:
+                    edits.append(_compileEdit('replace', replaceRule['old_text'], replaceRule['new_text']))
+
+            compiledRules.append({"number": number, "pattern": re.compile(filePattern), "rule": rule, "edits": edits})
+        except re.error as e:
+            run.emit('error', 'config', f"\n{Colors.RED}Configuration error: invalid pattern in rule for '{filePattern}': {e}{Colors.RESET}", rule=number)
+            run.errorList["modifications"] += 1
+        except KeyError as e:
+            run.emit('error', 'config', f"\n{Colors.RED}Configuration error: missing {e} in rule for '{filePattern}'{Colors.RESET}", rule=number)
+            run.errorList["modifications"] += 1
+    return compiledRules
+
+
+def findFirstOccurrences(content, needles):
+    """Find the first occurrence of every plain (bytes) needle with a single scan over the content."""
+    positions = {}
+    pending = set()
+    for needle in needles:
+        if needle:
+            pending.add(needle)
+        else:
+            positions[needle] = 0
+
+    position = 0
+    while pending:
+        # Combined alternation of all needles that are still missing (longest first)
+        scanner = re.compile(b'|'.join(re.escape(needle) for needle in sorted(pending, key=len, reverse=True)))
+        match = scanner.search(content, position)
+        if not match:
+            break
+        position = match.start()
+        for needle in [needle for needle in pending if content[position:position + len(needle)] == needle]:
+            positions[needle] = position
+            pending.discard(needle)
+        position += 1
+    return positions
+
+
+def _neededNeedles(fileRules):
+    """Collect all plain markers and texts whose first occurrence is needed by the rules of a file."""
+    needles = set()
+    for compiledRule in fileRules:
+        for edit in compiledRule['edits']:
+            if edit['action'] == 'replace':
+                needles.add(edit['data'])
+            if edit['regex'] is None:
+                needles.add(edit['needle'])
+    return needles
+
+
+# Any byte outside of ASCII, a file without one is searched by regex markers as plain bytes
+_NON_ASCII = re.compile(rb'[\x80-\xff]')
+
+
+def _bytesPattern(edit, key):
+    """Return the bytes variant of a compiled regex marker, None if it only works on text.
+
+    Only ASCII patterns are compiled as bytes: str-only syntax (\\u00e4, \\N{...}, (?u)) fails to compile
+    and non-ASCII literals could match ASCII text case-insensitively, both are searched as text.
+    """
+    name = key + 'Bytes'
+    if name not in edit:
+        pattern = edit[key]
+        try:
+            edit[name] = re.compile(pattern.pattern.encode('ascii'), pattern.flags & ~re.UNICODE) if pattern.pattern.isascii() else None
+        except re.error:
+            edit[name] = None
+    return edit[name]
+
+
+def _decodedText(content, decoded):
+    """Decode the content once per file (kept in the decoded dict), without copying it to bytes first."""
+    if 'text' not in decoded:
+        decoded['text'] = str(content, 'utf-8', 'surrogateescape')
+    return decoded['text']
+
+
+def _byteOffset(decoded, index):
+    """Map an offset in the decoded text back to a byte offset.
+
+    The byte offset of every OFFSET_CHUNK-th character is computed once per text, so only the text
+    between the last of them and index is encoded again.
+    """
+    text = decoded['text']
+    if 'offsets' not in decoded:
+        offsets = [0]
+        for chunkStart in range(0, len(text), OFFSET_CHUNK):
+            offsets.append(offsets[-1] + len(text[chunkStart:chunkStart + OFFSET_CHUNK].encode('utf-8', 'surrogateescape')))
+        decoded['offsets'] = offsets
+    chunk = index // OFFSET_CHUNK
+    return decoded['offsets'][chunk] + len(text[chunk * OFFSET_CHUNK:index].encode('utf-8', 'surrogateescape'))
+
+
+def _searchRegex(edit, content, decoded, key='regex'):
+    """Search the first match of a regex marker, returns (start, end, matched bytes, match) or None.
+
+    Non-ASCII content is searched in the decoded text, the match is mapped back to byte offsets.
+    """
+    if 'ascii' not in decoded:
+        decoded['ascii'] = not _NON_ASCII.search(content)
+    pattern = _bytesPattern(edit, key)
+    if decoded['ascii'] and pattern is not None:
+        match = pattern.search(content)
+        return (match.start(), match.end(), match.group(0), match) if match else None
+
+    match = edit[key].search(_decodedText(content, decoded))
+    if not match:
+        return None
+    matched = match.group(0).encode('utf-8', 'surrogateescape')
+    start = match.start() if decoded['ascii'] else _byteOffset(decoded, match.start())
+    return start, start + len(matched), matched, match
+
+
+def _expandMatch(match, edit):
+    """Expand the replacement template of a regex marker match to bytes."""
+    if isinstance(match.re.pattern, bytes):
+        return match.expand(edit['data'])
+    return match.expand(edit['text']).encode('utf-8', 'surrogateescape')
+
+
+def _pieceSize(piece):
+    """Length of a piece of planned content: inserted bytes or an (start, end) range of the original."""
+    return len(piece) if isinstance(piece, bytes) else piece[1] - piece[0]
+
+
+def _cutPiece(piece, low, high):
+    """Return [low, high) of a piece, relative to its start."""
+    return piece[low:high] if isinstance(piece, bytes) else (piece[0] + low, piece[0] + high)
+
+
+class PlannedContent:
+    """Content of a file while its edits are planned: unchanged ranges of the original and inserted bytes.
+
+    ranges holds the byte ranges confirming the edits, every splice shifts them (see confirm()).
+    """
+
+    def __init__(self, content, positions=None, needles=()):
+        self.original = content
+        self.pieces = [(0, len(content))] if len(content) else []
+        self.length = len(content)
+        self.changed = False
+        self.decoded = {}
+        self.ranges = []
+        self._flat = None
+        # First occurrence of a needle in the original, -1 if missing (the scanned needles, others are searched once)
+        self._first = {needle: (positions or {}).get(needle, -1) for needle in needles}
+
+    def snapshot(self):
+        """Return the current content for restore(), e.g. to drop the edits of a failing rule."""
+        return list(self.pieces), self.length, self.changed, list(self.ranges)
+
+    def restore(self, snapshot):
+        pieces, self.length, self.changed, ranges = snapshot
+        self.pieces = list(pieces)
+        self.ranges = list(ranges)
+        self._flat = None
+        self.decoded = {}
+
+    def _segments(self):
+        """Yield (offset, piece) for every piece, offsets in the current content."""
+        offset = 0
+        for piece in self.pieces:
+            yield offset, piece
+            offset += _pieceSize(piece)
+
+    def flat(self):
+        """Return the whole current content (the original itself while nothing changed)."""
+        if not self.changed:
+            return self.original
+        if self._flat is None:
+            self._flat = self.slice(0, self.length)
+        return self._flat
+
+    def slice(self, start, end):
+        """Return the bytes of [start, end) of the current content."""
+        start, end = max(0, start), min(self.length, end)
+        parts = []
+        for offset, piece in self._segments():
+            size = _pieceSize(piece)
+            if offset + size <= start:
+                continue
+            if offset >= end:
+                break
+            piece = _cutPiece(piece, max(start, offset) - offset, min(end, offset + size) - offset)
+            parts.append(piece if isinstance(piece, bytes) else self.original[piece[0]:piece[1]])
+        return b''.join(parts)
+
+    def find(self, needle):
+        """Return the offset of the first occurrence of needle in the current content, or -1."""
+        if not needle:
+            return 0
+        if needle not in self._first:
+            self._first[needle] = self.original.find(needle)
+        position = self._first[needle]
+        if not self.changed:
+            return position
+
+        # First occurrence inside one unchanged range, original ranges keep their order
+        found = -1
+        while position != -1 and found == -1:
+            for offset, piece in self._segments():
+                if isinstance(piece, tuple) and piece[0] <= position and position + len(needle) <= piece[1]:
+                    found = offset + position - piece[0]
+                    break
+            else:
+                position = self.original.find(needle, position + 1)
+
+        # Occurrences touching inserted text or a seam where original text was cut out
+        previous = None
+        for offset, piece in self._segments():
+            if isinstance(piece, bytes):
+                size = len(piece)
+            elif isinstance(previous, tuple) and previous[1] != piece[0]:
+                size = 0
+            else:
+                previous = piece
+                continue
+            previous = piece
+            windowStart = max(0, offset - len(needle) + 1)
+            index = self.slice(windowStart, offset + size + len(needle) - 1).find(needle)
+            if index != -1 and (found == -1 or windowStart + index < found):
+                found = windowStart + index
+        return found
+
+    def splice(self, start, end, data):
+        """Replace [start, end) of the current content with data."""
+        heads, tails = [], []
+        for offset, piece in self._segments():
+            size = _pieceSize(piece)
+            if offset < start:
+                heads.append(_cutPiece(piece, 0, min(size, start - offset)))
+            if offset + size > end:
+                tails.append(_cutPiece(piece, max(0, end - offset), size))
+        self.pieces = [piece for piece in heads + [data] + tails if _pieceSize(piece)]
+        self.length += len(data) - (end - start)
+
+        # Ranges behind the splice move with it, ranges it touches grow to cover the new text
+        delta = len(data) - (end - start)
+        shifted = []
+        for rule, low, high in self.ranges:
+            if high <= start:
+                shifted.append((rule, low, high))
+            elif low >= end:
+                shifted.append((rule, low + delta, high + delta))
+            else:
+                shifted.append((rule, min(low, start), max(high, end) + delta))
+        self.ranges = shifted
+        self.changed = True
+        self._flat = None
+        self.decoded = {}
+
+    def confirm(self, rule, start, end):
+        """Remember the byte range of the current content that holds an edit of rule (applied or found applied)."""
+        self.ranges.append((rule, max(0, start), min(self.length, end)))
+
+    def edits(self):
+        """Return the planned changes as ascending, disjoint Edits of the original."""
+        edits = []
+        position = 0
+        inserted = []
+        for piece in self.pieces + [(len(self.original), len(self.original))]:
+            if isinstance(piece, bytes):
+                inserted.append(piece)
+                continue
+            if piece[0] != position or inserted:
+                edits.append(Edit(position, piece[0], b''.join(inserted)))
+            position = piece[1]
+            inserted = []
+        return edits
+
+
+def planRuleEdits(content, compiledRule, filePath):
+    """Apply the edits of one modification rule to the planned content, one after another.
+
+    Returns (messages, modifications, warnings), raises ValueError if a marker is not found.
+    """
+    messages = []
+    modifications = 0
+    warnings = 0
+
+    def confirmed(start, end):
+        content.confirm(compiledRule['number'], start, end)
+
+    for edit in compiledRule['edits']:
+        action = edit['action']
+        text = edit['text']
+        data = edit['data']
+
+        # AFTER TEXT INSERTION
+        if action == 'after':
+            if edit['regex'] is not None:
+                pattern = edit['anchor']
+                # search first occurrence
+                found = _searchRegex(edit, content.flat(), content.decoded)
+                if not found:
+                    raise ValueError(f"Regex after_text pattern '{pattern}' not found in file: {filePath}")
+                start, end, anchor, _ = found
+                # idempotency check
+                if anchor + data in content.slice(start, start + len(anchor) + len(data) + 5):
+                    messages.append(f"  {Colors.YELLOW}Regex after_text already has insertion after anchor.{Colors.RESET}")
+                    warnings += 1
+                    confirmed(start, start + len(anchor) + len(data) + 5)
+                else:
+                    messages.append(f"  {Colors.GREEN}Regex inserting after anchor: /{pattern}/ -> {text[:60]}...{Colors.RESET}")
+                    content.splice(end, end, data)
+                    confirmed(start, end + len(data))
+                    modifications += 1
+            else:
+                # Plain (substring) variant – use first occurrence only (consistent with replace count=1)
+                anchor = edit['anchor']
+                idx = content.find(edit['needle'])
+                if idx == -1:
+                    raise ValueError(f"Text '{anchor}' not found in file: {filePath}")
+                after_pos = idx + len(edit['needle'])
+                # Precise idempotency: is insert_text already directly after anchor?
+                if content.slice(after_pos, after_pos + len(data)) == data:
+                    messages.append(f"  {Colors.YELLOW}Plain after_text already directly followed by insertion (idempotent).{Colors.RESET}")
+                    warnings += 1
+                    confirmed(idx, after_pos + len(data))
+                else:
+                    messages.append(f"  {Colors.GREEN}Inserting text after (plain): {anchor[:40]} -> {text[:60]}...{Colors.RESET}")
+                    content.splice(after_pos, after_pos, data)
+                    confirmed(idx, after_pos + len(data))
+                    modifications += 1
+
+        # BEFORE TEXT INSERTION
+        elif action == 'before':
+            if edit['regex'] is not None:
+                pattern = edit['anchor']
+                found = _searchRegex(edit, content.flat(), content.decoded)
+                if not found:
+                    raise ValueError(f"Regex before_text pattern '{pattern}' not found in file: {filePath}")
+                start, end, anchor, _ = found
+                segment_start = max(0, start - len(data) - 5)
+                if data + anchor in content.slice(segment_start, end + len(data)):
+                    messages.append(f"  {Colors.YELLOW}Regex before_text already has insertion before anchor.{Colors.RESET}")
+                    warnings += 1
+                    confirmed(segment_start, end + len(data))
+                else:
+                    messages.append(f"  {Colors.GREEN}Regex inserting before anchor: /{pattern}/ <- {text[:60]}...{Colors.RESET}")
+                    content.splice(start, start, data)
+                    confirmed(start, end + len(data))
+                    modifications += 1
+            else:
+                # Plain (substring) variant – first occurrence logic
+                anchor = edit['anchor']
+                before_pos = content.find(edit['needle'])
+                if before_pos == -1:
+                    raise ValueError(f"Text '{anchor}' not found in file: {filePath}")
+                # Precise idempotency: does insert_text already sit immediately before anchor?
+                if before_pos >= len(data) and content.slice(before_pos - len(data), before_pos) == data:
+                    messages.append(f"  {Colors.YELLOW}Plain before_text already directly preceded by insertion (idempotent).{Colors.RESET}")
+                    warnings += 1
+                    confirmed(before_pos - len(data), before_pos + len(edit['needle']))
+                else:
+                    messages.append(f"  {Colors.GREEN}Inserting text before (plain): {text[:60]}... <- {anchor[:40]}{Colors.RESET}")
+                    content.splice(before_pos, before_pos, data)
+                    confirmed(before_pos, before_pos + len(data) + len(edit['needle']))
+                    modifications += 1
+
+        # REPLACE RULES
+        elif action == 'replace':
+            if edit['regex'] is not None:
+                pattern = edit['anchor']
+                # Replacements are confirmed by the first occurrence of their new text
+                position = content.find(data)
+                if position != -1:
+                    messages.append(f"  {Colors.YELLOW}Regex replacement already applied -> {text[:60]}...{Colors.RESET}")
+                    warnings += 1
+                    confirmed(position, position + len(data))
+                    continue
+                if not _searchRegex(edit, content.flat(), content.decoded):
+                    raise ValueError(f"Regex old_text pattern '{pattern}' not found in file: {filePath}")
+                # The replacement itself matches without DOTALL, like re.subn
+                found = _searchRegex(edit, content.flat(), content.decoded, 'replaceRegex')
+                if found:
+                    start, end, _, match = found
+                    messages.append(f"  {Colors.GREEN}Regex replacing pattern /{pattern}/ -> {text[:60]}...{Colors.RESET}")
+                    replacement = _expandMatch(match, edit)
+                    content.splice(start, end, replacement)
+                    confirmed(start, start + len(replacement))
+                    modifications += 1
+                else:
+                    messages.append(f"  {Colors.YELLOW}Regex replacement produced no change for /{pattern}/.{Colors.RESET}")
+                    warnings += 1
+            else:
+                old_text = edit['anchor']
+                position = content.find(edit['needle'])
+                replaced = content.find(data)
+                if position == -1 and replaced == -1:
+                    raise ValueError(f"Text '{old_text}' not found in file: {filePath}")
+                elif replaced == -1:
+                    messages.append(f"  {Colors.GREEN}Replacing text: {old_text[:60]}... -> {text[:60]}...{Colors.RESET}")
+                    content.splice(position, position + len(edit['needle']), data)
+                    confirmed(position, position + len(data))
+                    modifications += 1
+                else:
+                    messages.append(f"  {Colors.YELLOW}Text already replaced: {old_text[:40]} -> {text[:40]}{Colors.RESET}")
+                    warnings += 1
+                    confirmed(replaced, replaced + len(data))
+
+    return messages, modifications, warnings
+
+
+def writeEdits(content, edits, tempPath):
+    """Stream the unchanged segments of the original and the edits into a new file.
+
+    content is memory mapped, so segments are written straight from the page cache and peak memory
+    stays close to one file size. Returns the SHA-256 hex digest of the written content.
+    """
+    digest = hashlib.sha256()
+    view = memoryview(content)
+    try:
+        with open(tempPath, 'wb') as output:
+            position = 0
+            for edit in sorted(edits) + [None]:
+                segment = view[position:edit.start] if edit is not None else view[position:]
+                output.write(segment)
+                digest.update(segment)
+                segment.release()
+                if edit is not None:
+                    output.write(edit.text)
+                    digest.update(edit.text)
+                    position = edit.end
+    finally:
+        view.release()
+    return digest.hexdigest()
+
+
+def _replaceFile(tempPath, filePath):
+    """Atomically rename a rewritten file over the original, keeping its permissions and owner."""
+    stat = os.stat(filePath)
+    os.chmod(tempPath, S_IMODE(stat.st_mode))
+    if hasattr(os, 'chown'):
+        try:
+            os.chown(tempPath, stat.st_uid, stat.st_gid)
+        except OSError:
+            pass
+    os.replace(tempPath, filePath)
+
+
+def _mapFile(file):
+    """Memory map an open file read-only (empty files can't be mapped)."""
+    if os.fstat(file.fileno()).st_size == 0:
+        return b''
+    return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def planModifications(compiledRules, destinationDirectory):
+    """Walk the destination once and map every matching file to its rules (in config order)."""
+    plan = {}
+    for root, _, files in os.walk(destinationDirectory):
+        for filename in files:
+            matchingRules = [compiledRule for compiledRule in compiledRules if compiledRule['pattern'].match(filename)]
+            if matchingRules:
+                plan[os.path.join(root, filename)] = matchingRules
+    return dict(sorted(plan.items()))
+
+
+def _rangeDigests(planned):
+    """Return [rule, start, end, digest] for the confirmed ranges of the final planned content."""
+    return [[rule, start, end, hashlib.sha256(planned.slice(start, end)).hexdigest()[:16]] for rule, start, end in planned.ranges]
+
+
+def verifyAnchors(path, size, anchors):
+    """Read only the indexed byte ranges of a file and check that they still hold the confirmed edits."""
+    try:
+        with open(path, 'rb') as file:
+            if os.fstat(file.fileno()).st_size != size:
+                return False
+            for _, start, end, digest in anchors:
+                file.seek(start)
+                if hashlib.sha256(file.read(end - start)).hexdigest()[:16] != digest:
+                    return False
+    except OSError:
+        return False
+    return True
+
+
+def modifyFile(filePath, fileRules, recordState=False, dryRun=False, backup=False):
+    """Map one file once, plan the edits of all its rules and stream the result into place.
+
+    Runs in worker processes as well, so it reports through the returned result instead of the run.
+    """
+    start = time.perf_counter()
+    result = {"path": filePath, "messages": [('action', 'file', f"\n{'Planning' if dryRun else 'Modifying'} file: {filePath}")], "modifications": 0,
+              "warnings": 0, "errors": 0, "complete": False, "signature": None, "sha256": None,
+              "rules": [], "bytesRead": 0, "bytesWritten": 0, "seconds": 0.0, "searchSeconds": 0.0, "writeSeconds": 0.0, "backup": None, "anchors": None}
+    tempPath = os.path.join(os.path.dirname(filePath), f".{os.path.basename(filePath)}.{os.getpid()}.tmp")
+    try:
+        acceptedEdits = []
+        applied = 0
+        backupRecord = None
+        with open(filePath, 'rb') as f:
+            # Search the raw UTF-8 bytes of the memory mapped file, only non-ASCII files with regex markers are decoded
+            content = _mapFile(f)
+            try:
+                result['bytesRead'] = len(content)
+
+                # Find the first occurrence of all plain markers in a single pass
+                searchStart = time.perf_counter()
+                needles = _neededNeedles(fileRules)
+                planned = PlannedContent(content, findFirstOccurrences(content, needles), needles)
+                scanSeconds = result['searchSeconds'] = time.perf_counter() - searchStart
+
+                # Apply the edits of every rule in config order to the planned content, a failing rule contributes no edits
+                for compiledRule in fileRules:
+                    ruleStart = time.perf_counter()
+                    ruleResult = {"rule": compiledRule['number'], "modifications": 0, "warnings": 0, "errors": 0}
+                    result['rules'].append(ruleResult)
+                    snapshot = planned.snapshot()
+                    try:
+                        messages, modifications, warnings = planRuleEdits(planned, compiledRule, filePath)
+                    except ValueError as e:
+                        planned.restore(snapshot)
+                        result['messages'].append(('error', 'edit', f"\n{Colors.RED}Error: {e}{Colors.RESET}"))
+                        result['errors'] += 1
+                        ruleResult['errors'] = 1
+                        continue
+                    finally:
+                        # Time spent searching the markers of this rule (and checking for earlier insertions)
+                        ruleResult['searchSeconds'] = time.perf_counter() - ruleStart
+                        result['searchSeconds'] += ruleResult['searchSeconds']
+
+                    result['messages'].extend(('action', 'edit', message) for message in messages)
+                    result['modifications'] += modifications
+                    result['warnings'] += warnings
+                    ruleResult.update(modifications=modifications, warnings=warnings)
+                    applied += 1
+
+                # The single scan for the plain markers is shared evenly by the rules of the file
+                for ruleResult in result['rules']:
+                    ruleResult['searchSeconds'] += scanSeconds / len(fileRules)
+
+                # Stream unchanged segments and edits into a temporary file, unchanged files are left alone
+                acceptedEdits = planned.edits()
+                writeStart = time.perf_counter()
+                if acceptedEdits and dryRun:
+                    result['bytesWritten'] = len(content) + sum(len(edit.text) - (edit.end - edit.start) for edit in acceptedEdits)
+                    result['messages'].append(('action', 'edit', f"  {Colors.CYAN}Dry run: {len(acceptedEdits)} edit(s) not written{Colors.RESET}"))
+                elif acceptedEdits:
+                    result['sha256'] = writeEdits(content, acceptedEdits, tempPath)
+                    result['bytesWritten'] = os.path.getsize(tempPath)
+                    if backup:
+                        backupRecord = {"before": hashlib.sha256(content).hexdigest(), "after": result['sha256'],
+                                        "edits": reverseEdits(content, acceptedEdits)}
+                elif recordState:
+                    result['sha256'] = hashlib.sha256(content).hexdigest()
+                result['writeSeconds'] = time.perf_counter() - writeStart
+                if recordState and not dryRun and applied == len(fileRules):
+                    result['anchors'] = _rangeDigests(planned)
+            finally:
+                if isinstance(content, mmap.mmap):
+                    content.close()
+
+        if acceptedEdits and not dryRun:
+            _replaceFile(tempPath, filePath)
+            result['backup'] = backupRecord
+
+        # Only files where every rule succeeded are remembered, failing ones are retried next run
+        result['complete'] = applied == len(fileRules)
+        if recordState and result['complete']:
+            stat = os.stat(filePath)
+            result['signature'] = [stat.st_size, stat.st_mtime_ns]
+        else:
+            result['sha256'] = result['anchors'] = None
+
+    except ValueError as e:
+        result['messages'].append(('error', 'file', f"\n{Colors.RED}Error: {e}{Colors.RESET}"))
+        result['errors'] += 1
+
+    except PermissionError:
+        result['messages'].append(('error', 'file', f"\n{Colors.RED}Error: Permission denied when modifying {filePath}{Colors.RESET}"))
+        result['errors'] += 1
+
+    except IOError as e:
+        result['messages'].append(('error', 'file', f"\n{Colors.RED}Error reading/writing file {filePath}: {e}{Colors.RESET}"))
+        result['errors'] += 1
+
+    finally:
+        if os.path.lexists(tempPath):
+            os.remove(tempPath)
+
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+# Compiled rules of a worker process, shipped once per worker by the pool initializer
+_workerRules = {}
+
+
+def _initModifyWorker(compiledRules):
+    """Pool initializer: keep the compiled rules in the worker process."""
+    global _workerRules
+    _workerRules = {compiledRule['number']: compiledRule for compiledRule in compiledRules}
+
+
+def _modifyFileInWorker(task):
+    """Pool task: modify one file, the rules are referenced by their number."""
+    filePath, ruleNumbers, recordState, dryRun, backup = task
+    return modifyFile(filePath, [_workerRules[number] for number in ruleNumbers], recordState, dryRun, backup)
+
+
+def _newModifyPool(jobs, compiledRules):
+    """Create the process pool of the modification step.
+
+    A fork only copies the calling thread, so a pool created outside the main thread (e.g. a service
+    calling Customizer.run() from several threads) starts its workers through a fork server or spawn.
+    """
+    context = None
+    if threading.current_thread() is not threading.main_thread():
+        context = multiprocessing.get_context('forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+    return ProcessPoolExecutor(max_workers=jobs, mp_context=context, initializer=_initModifyWorker, initargs=(compiledRules,))
+
+
+def _runModifyTasks(run, tasks, compiledRules, jobs):
+    """Yield the results of the modification tasks in task order, using a process pool when useful."""
+    sharedExecutor = run.sharedInputs.modifyExecutor if run.sharedInputs is not None else None
+    if sharedExecutor is not None and len(tasks) > 1:
+        yield from sharedExecutor.map(_modifyFileInWorker, tasks, chunksize=max(1, len(tasks) // (jobs * 4)))
+        return
+    if jobs > 1 and len(tasks) > 1:
+        try:
+            executor = _newModifyPool(min(jobs, len(tasks)), compiledRules)
+        except (OSError, NotImplementedError) as e:
+            run.emit('warning', 'pool', f"{Colors.YELLOW}Process pool unavailable ({e}), modifying files serially.{Colors.RESET}")
+        else:
+            with executor:
+                chunksize = max(1, len(tasks) // (jobs * 4))
+                yield from executor.map(_modifyFileInWorker, tasks, chunksize=chunksize)
+            return
+
+    rulesByNumber = {compiledRule['number']: compiledRule for compiledRule in compiledRules}
+    for filePath, ruleNumbers, recordState, dryRun, backup in tasks:
+        yield modifyFile(filePath, [rulesByNumber[number] for number in ruleNumbers], recordState, dryRun, backup)
+
+
+def _anchorsConfirm(filePath, signature, cached, anchors):
+    """True if the anchor index of the remembered content confirms the edits of a file with a new signature."""
+    index = anchors.get(cached['sha256'])
+    return (index is not None and index['rules'] == cached['rules'] and isinstance(signature, list)
+            and signature[0] == cached['signature'][0] and verifyAnchors(filePath, signature[0], index['ranges']))
+
+
+def modifyFiles(run, config, destinationDirectory, changedPaths=None):
+    """Modify files according to modification rules.
+
+    Files whose indexed anchor ranges still hold the edits are skipped as verified instead of searched.
+    """
+    run.emit('info', 'phase', f"{Colors.YELLOW}Starting file modification process...{Colors.RESET}", phase='modify')
+    if run.sharedInputs is not None:
+        compiledRules = run.sharedInputs.compiledRules
+    else:
+        compiledRules = compileModificationRules(run, config)
+    plan = planModifications(compiledRules, destinationDirectory)
+    cachedFiles = run.state['files'] if run.state is not None else {}
+    cachedAnchors = run.state['anchors'] if run.state is not None else {}
+    seenFiles = {}
+    seenAnchors = {}
+
+    if changedPaths is not None:
+        for filePath in [filePath for filePath in plan if not _underAny(os.path.abspath(filePath), changedPaths)]:
+            cacheKey = os.path.relpath(filePath, destinationDirectory)
+            if cacheKey in cachedFiles:
+                seenFiles[cacheKey] = cachedFiles[cacheKey]
+            del plan[filePath]
+
+    ruleReports = {}
+    for compiledRule in compiledRules:
+        matched = sum(1 for fileRules in plan.values() if compiledRule in fileRules)
+        run.emit('info', 'rule', f"Processing files matching pattern: {compiledRule['pattern'].pattern} ({matched} file(s))",
+                 rule=compiledRule['number'], pattern=compiledRule['pattern'].pattern, files=matched)
+        ruleReports[compiledRule['number']] = {"rule": compiledRule['number'], "pattern": compiledRule['pattern'].pattern, "files": matched,
+                                               "cacheSkips": 0, "modifications": 0, "warnings": 0, "errors": 0,
+                                               "bytesRead": 0, "bytesWritten": 0, "seconds": 0.0}
+
+    # Skip files that are unchanged since the last run and targeted by the same rules
+    tasks = []
+    rulesFingerprints = {}
+    for filePath, fileRules in plan.items():
+        cacheKey = os.path.relpath(filePath, destinationDirectory)
+        rulesFingerprints[filePath] = fingerprint([compiledRule['rule'] for compiledRule in fileRules])
+        cached = cachedFiles.get(cacheKey)
+        try:
+            signature = statSignature(run, filePath)
+            decision = None
+            if cached and cached['rules'] == rulesFingerprints[filePath]:
+                if cached['signature'] == signature:
+                    decision = 'cached'
+                    run.emit('action', 'file.skip', f"Skipping {filePath}: unchanged since last run (cached)", path=filePath, reason='cached')
+                    seenFiles[cacheKey] = cached
+                elif _anchorsConfirm(filePath, signature, cached, cachedAnchors):
+                    # Touched or rewritten, but the edits are still in place at their indexed ranges
+                    decision = 'verified'
+                    run.emit('action', 'file.skip', f"Skipping {filePath}: edits verified in place (anchor index)", path=filePath, reason='verified')
+                    seenFiles[cacheKey] = dict(cached, signature=signature)
+            if decision is not None:
+                run.results['cacheSkips'] += 1
+                if run.report is not None:
+                    run.report['files'].append({"phase": "modify", "path": filePath, "rules": [compiledRule['number'] for compiledRule in fileRules],
+                                            "decision": decision, "modifications": 0, "bytesRead": 0, "bytesWritten": 0,
+                                            "seconds": 0.0, "searchSeconds": 0.0, "writeSeconds": 0.0})
+                    for compiledRule in fileRules:
+                        ruleReports[compiledRule['number']]['cacheSkips'] += 1
+                continue
+        except OSError:
+            pass
+        tasks.append((filePath, [compiledRule['number'] for compiledRule in fileRules], run.state is not None, run.dryRun, run.backup is not None))
+
+    # Modify the remaining files (in parallel), results are merged in file path order
+    for result in _runModifyTasks(run, tasks, compiledRules, run.jobs or os.cpu_count() or 1):
+        run.statCache.invalidate(result['path'])
+        if result['bytesWritten'] and not run.dryRun:
+            run.wrote(result['path'])
+        if result['backup'] is not None:
+            run.backup.edited(result['path'], **result['backup'])
+        for level, kind, message in result['messages']:
+            run.emit(level, kind, message, path=result['path'])
+        run.results['modifications'] += result['modifications']
+        run.errorList['modWarnings'] += result['warnings']
+        run.errorList['modifications'] += result['errors']
+
+        if run.report is not None:
+            decision = 'error' if result['errors'] else 'modify' if result['bytesWritten'] else 'unchanged'
+            run.report['files'].append({"phase": "modify", "path": result['path'], "rules": [ruleResult['rule'] for ruleResult in result['rules']],
+                                    "decision": decision, "modifications": result['modifications'], "bytesRead": result['bytesRead'],
+                                    "bytesWritten": result['bytesWritten'], "seconds": result['seconds'],
+                                    "searchSeconds": result['searchSeconds'], "writeSeconds": result['writeSeconds']})
+            for ruleResult in result['rules']:
+                ruleReport = ruleReports[ruleResult['rule']]
+                for key in ('modifications', 'warnings', 'errors'):
+                    ruleReport[key] += ruleResult[key]
+                ruleReport['bytesRead'] += result['bytesRead']
+                ruleReport['bytesWritten'] += result['bytesWritten'] if ruleResult['modifications'] else 0
+                ruleReport['seconds'] += ruleResult['searchSeconds']
+
+        if result['sha256'] is not None:
+            seenFiles[os.path.relpath(result['path'], destinationDirectory)] = {
+                "rules": rulesFingerprints[result['path']],
+                "signature": result['signature'],
+                "sha256": result['sha256'],
+            }
+            if result['anchors'] is not None:
+                seenAnchors[result['sha256']] = {"rules": rulesFingerprints[result['path']], "ranges": result['anchors']}
+
+    if run.state is not None:
+        # Keep the index entries of the remembered contents only (files left out by changedPaths included)
+        for cached in seenFiles.values():
+            if cached['sha256'] in cachedAnchors and cached['sha256'] not in seenAnchors:
+                seenAnchors[cached['sha256']] = cachedAnchors[cached['sha256']]
+        run.state['files'] = seenFiles
+        run.state['anchors'] = seenAnchors
+    if run.report is not None:
+        run.report['modificationRules'].extend(ruleReports.values())
+
+    run.emit('info', 'phase', f"\n{Colors.GREEN}File modification process completed{Colors.RESET} with {Colors.RED}{run.errorList['modifications']} errors{Colors.RESET} and {Colors.YELLOW}{run.errorList['modWarnings']} warnings{Colors.RESET}.\n",
+             phase='modify', errors=run.errorList['modifications'], warnings=run.errorList['modWarnings'])
+
+
+def checkModifications(run, config, destinationDirectory):
+    """Try the modification rules on the new and changed files of the destination, nothing is written.
+
+    Returns the rules expected to break as {rule number: [paths of the files their markers are missing in]}.
+    """
+    run.emit('info', 'phase', f"{Colors.YELLOW}Checking the modification rules against new and changed files...{Colors.RESET}", phase='check')
+    compiledRules = compileModificationRules(run, config)
+    plan = planModifications(compiledRules, destinationDirectory)
+    cachedFiles = run.state['files'] if run.state is not None else {}
+    cachedAnchors = run.state['anchors'] if run.state is not None else {}
+
+    tasks = []
+    for filePath, fileRules in plan.items():
+        cached = cachedFiles.get(os.path.relpath(filePath, destinationDirectory))
+        try:
+            signature = statSignature(run, filePath)
+            if (cached and cached['rules'] == fingerprint([compiledRule['rule'] for compiledRule in fileRules])
+                    and (cached['signature'] == signature or _anchorsConfirm(filePath, signature, cached, cachedAnchors))):
+                run.emit('action', 'file.skip', f"Skipping {filePath}: known from the last run", path=filePath, reason='known')
+                continue
+        except OSError:
+            pass
+        tasks.append((filePath, [compiledRule['number'] for compiledRule in fileRules], False, True, False))
+
+    checked = {compiledRule['number']: 0 for compiledRule in compiledRules}
+    broken = {}
+    for result in _runModifyTasks(run, tasks, compiledRules, run.jobs or os.cpu_count() or 1):
+        for level, kind, message in result['messages']:
+            run.emit(level, kind, message, path=result['path'])
+        for ruleResult in result['rules']:
+            checked[ruleResult['rule']] += 1
+            if ruleResult['errors']:
+                broken.setdefault(ruleResult['rule'], []).append(result['path'])
+        if result['errors'] and not result['rules']:
+            run.errorList['modifications'] += result['errors']
+
+    lines = [f"\n{Colors.CYAN}Preflight check of {destinationDirectory} ({len(tasks)} new or changed file(s)):{Colors.RESET}"]
+    for compiledRule in compiledRules:
+        number = compiledRule['number']
+        pattern = compiledRule['pattern'].pattern
+        matched = sum(1 for fileRules in plan.values() if compiledRule in fileRules)
+        if not matched:
+            lines.append(f"{Colors.YELLOW}  Rule #{number} ({pattern}): matches no files{Colors.RESET}")
+        elif number in broken:
+            lines.append(f"{Colors.RED}  Rule #{number} ({pattern}): markers missing in {len(broken[number])} of {checked[number]} new or changed file(s): "
+                         f"{', '.join(broken[number])}{Colors.RESET}")
+        elif checked[number]:
+            lines.append(f"{Colors.GREEN}  Rule #{number} ({pattern}): markers found in {checked[number]} new or changed file(s){Colors.RESET}")
+        else:
+            lines.append(f"  Rule #{number} ({pattern}): {matched} file(s) known from the last run")
+    run.errorList['modifications'] += sum(len(paths) for paths in broken.values())
+    if broken:
+        lines.append(f"{Colors.RED}{len(broken)} rule(s) expected to break, nothing was written.{Colors.RESET}")
+    else:
+        lines.append(f"{Colors.GREEN}No rule is expected to break.{Colors.RESET}")
+    run.emit('summary', 'check', '\n'.join(lines), files=len(tasks), broken={str(number): paths for number, paths in broken.items()})
+    return broken
+
+
+# MARK: Backups
+def reverseEdits(content, edits):
+    """Return the edits that turn the modified content back into the original content.
+
+    Each one is [offset, length, original bytes] in the coordinates of the modified content, ascending.
+    """
+    reverse = []
+    shift = 0
+    for edit in sorted(edits):
+        reverse.append([edit.start + shift, len(edit.text), bytes(content[edit.start:edit.end])])
+        shift += len(edit.text) - (edit.end - edit.start)
+    return reverse
+
+
+def _applyReverseEdits(content, reverse):
+    """Rebuild the original content from the modified content and its reverse edits."""
+    parts = []
+    position = 0
+    for offset, length, original in reverse:
+        parts.append(content[position:offset])
+        parts.append(original)
+        position = offset + length
+    parts.append(content[position:])
+    return b''.join(parts)
+
+
+def defaultBackupPath(configPath):
+    """Return the default backup store location (next to the config file)."""
+    return os.path.splitext(configPath)[0] + '.backups'
+
+
+class BackupStore:
+    """Backups of one run: what it replaced, removed, created and modified below a destination.
+
+    Replaced and removed files are kept as content-addressed blobs, modified files as their reverse
+    edits. commit() writes the manifest of the run to runs/<run id>.json.
+    """
+
+    def __init__(self, directory, root, destination):
+        self.directory = directory
+        self.root = root
+        self.destination = os.path.abspath(destination)
+        self.entries = []
+        self._lock = threading.Lock()
+
+    def _relPath(self, path):
+        return os.path.relpath(path, self.root)
+
+    def _storeBlob(self, path):
+        """Keep a copy of a file under its content hash, known contents are not copied again."""
+        sha256 = hashFile(path)
+        blobPath = _blobPath(self.directory, sha256)
+        if not os.path.exists(blobPath):
+            os.makedirs(os.path.dirname(blobPath), exist_ok=True)
+            tempPath = f"{blobPath}.{os.getpid()}.{threading.get_ident()}.tmp"
+            shutil.copyfile(path, tempPath)
+            os.replace(tempPath, blobPath)
+        return sha256
+
+    def add(self, entry):
+        with self._lock:
+            self.entries.append(entry)
+
+    def replacing(self, path):
+        """Back up a file that is about to be replaced (or created), add() the entry once it was written."""
+        if os.path.isfile(path):
+            return {"type": "file", "path": self._relPath(path), "blob": self._storeBlob(path), "after": None}
+        return {"type": "created", "path": self._relPath(path), "after": None}
+
+    def removing(self, path):
+        """Back up a file or every file of a directory tree that is about to be removed."""
+        paths = [path] if not os.path.isdir(path) else [os.path.join(path, relPath) for relPath in sorted(_scanTree(path)[0])]
+        for filePath in paths:
+            self.add({"type": "file", "path": self._relPath(filePath), "blob": self._storeBlob(filePath), "after": None})
+
+    def createdDirectory(self, path):
+        """Record a directory the run created, restore removes it again if it is empty."""
+        relPath = self._relPath(path)
+        if relPath != os.curdir and not relPath.startswith(os.pardir):
+            self.add({"type": "directory", "path": relPath})
+
+    def edited(self, path, before, after, edits):
+        """Record the reverse edits of a modified file."""
+        self.add({"type": "edits", "path": self._relPath(path), "before": before, "after": after,
+                  "edits": [[offset, length, original.decode('utf-8', 'surrogateescape')] for offset, length, original in edits]})
+
+    def commit(self):
+        """Write the manifest of the run, returns its id (None if the run changed nothing)."""
+        if not self.entries:
+            return None
+        runsDirectory = os.path.join(self.directory, 'runs')
+        os.makedirs(runsDirectory, exist_ok=True)
+        baseId = f"{time.strftime('%Y%m%d-%H%M%S')}-{fingerprint(self.destination)[:6]}"
+        runId, number = baseId, 1
+        while os.path.exists(os.path.join(runsDirectory, runId + '.json')):
+            runId, number = f"{baseId}.{number}", number + 1
+        manifest = {"version": BACKUP_VERSION, "id": runId, "time": time.time(), "destination": self.destination, "entries": self.entries}
+        tempPath = os.path.join(runsDirectory, f".{runId}.json.tmp")
+        with open(tempPath, 'w', encoding='utf-8') as file:
+            json.dump(manifest, file)
+        os.replace(tempPath, os.path.join(runsDirectory, runId + '.json'))
+        return runId
+
+
+def _blobPath(directory, sha256):
+    return os.path.join(directory, 'blobs', sha256[:2], sha256)
+
+
+def loadBackupRuns(directory, destination=None):
+    """Return the run manifests of a backup store (of one destination), oldest first."""
+    runsDirectory = os.path.join(directory, 'runs')
+    manifests = []
+    for name in sorted(os.listdir(runsDirectory)) if os.path.isdir(runsDirectory) else []:
+        if not name.endswith('.json') or name.startswith('.'):
+            continue
+        with open(os.path.join(runsDirectory, name), 'r', encoding='utf-8') as file:
+            manifest = json.load(file)
+        if manifest.get('version') == BACKUP_VERSION and (destination is None or manifest['destination'] == os.path.abspath(destination)):
+            manifests.append(manifest)
+    return sorted(manifests, key=lambda manifest: (manifest['time'], manifest['id']))
+
+
+def _undoEntry(entry, content, directory):
+    """Undo one backup entry on the current content (None: file missing), raises ValueError on a hash mismatch."""
+    current = None if content is None else hashlib.sha256(content).hexdigest()
+    if current != entry['after']:
+        raise ValueError(f"{entry['path']} changed since the backup (expected {entry['after'] or 'no file'}, found {current or 'no file'})")
+    if entry['type'] == 'created':
+        return None
+    if entry['type'] == 'file':
+        with open(_blobPath(directory, entry['blob']), 'rb') as file:
+            content = file.read()
+        if hashlib.sha256(content).hexdigest() != entry['blob']:
+            raise ValueError(f"Backup of {entry['path']} is damaged (blob {entry['blob']})")
+        return content
+    content = _applyReverseEdits(content, [(offset, length, original.encode('utf-8', 'surrogateescape'))
+                                           for offset, length, original in entry['edits']])
+    if hashlib.sha256(content).hexdigest() != entry['before']:
+        raise ValueError(f"Reverse edits of {entry['path']} did not restore the original (expected {entry['before']})")
+    return content
+
+
+def restoreBackup(run, directory, destinationDirectory, runId=None):
+    """Undo the runs from runId (default: the last one) to the newest one in a single pass over the files.
+
+    Files changed since the newest run are left untouched and reported.
+    """
+    manifests = loadBackupRuns(directory, destinationDirectory)
+    ids = [manifest['id'] for manifest in manifests]
+    if not manifests:
+        raise FileNotFoundError(f"No backups of {destinationDirectory} in {directory}")
+    if runId and runId not in ids:
+        raise FileNotFoundError(f"No backup run {runId} of {destinationDirectory}, available: {', '.join(ids)}")
+    undone = manifests[ids.index(runId) if runId else -1:]
+
+    # Undo the entries per file, newest first
+    changes = {}
+    createdDirectories = set()
+    for manifest in reversed(undone):
+        for entry in reversed(manifest['entries']):
+            if entry['type'] == 'directory':
+                createdDirectories.add(entry['path'])
+            else:
+                changes.setdefault(entry['path'], []).append(entry)
+
+    restored = 0
+    failedPaths = set()
+    for relPath, entries in sorted(changes.items()):
+        filePath = os.path.join(destinationDirectory, relPath)
+        try:
+            content = None
+            if os.path.isfile(filePath):
+                with open(filePath, 'rb') as file:
+                    content = file.read()
+            for entry in entries:
+                content = _undoEntry(entry, content, directory)
+
+            if content is None:
+                if os.path.lexists(filePath):
+                    os.remove(filePath)
+                run.emit('action', 'restore', f"Removed {filePath}", path=filePath)
+            else:
+                os.makedirs(os.path.dirname(filePath) or os.curdir, exist_ok=True)
+                tempPath = os.path.join(os.path.dirname(filePath), f".{os.path.basename(filePath)}.{os.getpid()}.tmp")
+                with open(tempPath, 'wb') as file:
+                    file.write(content)
+                if os.path.exists(filePath):
+                    _replaceFile(tempPath, filePath)
+                else:
+                    os.replace(tempPath, filePath)
+                run.emit('action', 'restore', f"{Colors.GREEN}Restored {filePath}{Colors.RESET}", path=filePath)
+            restored += 1
+        except (OSError, ValueError) as e:
+            run.emit('error', 'restore', f"{Colors.RED}Error restoring {filePath}: {e}{Colors.RESET}", path=filePath)
+            run.errorList['copies'] += 1
+            failedPaths.add(relPath)
+
+    # Remove the directories the runs created, deepest first, unless something (e.g. a restored file) is still in them
+    for relPath in sorted(createdDirectories, key=lambda relPath: relPath.count(os.sep), reverse=True):
+        directoryPath = os.path.join(destinationDirectory, relPath)
+        if any(_pathsOverlap(failedPath, [relPath]) for failedPath in failedPaths):
+            failedPaths.add(relPath)
+            continue
+        try:
+            os.rmdir(directoryPath)
+            run.emit('action', 'restore', f"Removed directory {directoryPath}", path=directoryPath)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            if e.errno != errno.ENOTEMPTY:
+                run.emit('warning', 'restore', f"{Colors.YELLOW}Could not remove directory {directoryPath}: {e}{Colors.RESET}", path=directoryPath)
+                run.errorList['copyWarnings'] += 1
+
+    # Forget the undone runs (except for files that could not be restored) and the blobs no run refers to anymore
+    for manifest in undone:
+        manifestPath = os.path.join(directory, 'runs', manifest['id'] + '.json')
+        manifest['entries'] = [entry for entry in manifest['entries'] if entry['path'] in failedPaths]
+        if not manifest['entries']:
+            os.remove(manifestPath)
+            continue
+        with open(manifestPath + '.tmp', 'w', encoding='utf-8') as file:
+            json.dump(manifest, file)
+        os.replace(manifestPath + '.tmp', manifestPath)
+    referenced = {entry['blob'] for manifest in loadBackupRuns(directory) for entry in manifest['entries'] if entry['type'] == 'file'}
+    blobsDirectory = os.path.join(directory, 'blobs')
+    for root, _, files in os.walk(blobsDirectory, topdown=False):
+        for name in files:
+            if name not in referenced:
+                os.remove(os.path.join(root, name))
+        if root != blobsDirectory and not os.listdir(root):
+            os.rmdir(root)
+
+    color = Colors.RED if run.failed else Colors.GREEN
+    run.emit('summary', 'restore', f"\n{color}Restored {restored} of {len(changes)} file(s) in {destinationDirectory} to their state before run {undone[0]['id']}"
+             f"{f' ({len(undone)} runs undone)' if len(undone) > 1 else ''}.{Colors.RESET}",
+             runs=[manifest['id'] for manifest in undone], files=len(changes), restored=restored, errors=run.errorList['copies'])
+
+
+# MARK: Staged builds
+# C library handle, loaded on first use (inotify, renameat2)
+_libcHandle = None
+
+
+def _libc():
+    """Return the C library through ctypes, with errno tracking."""
+    global _libcHandle
+    if _libcHandle is None:
+        _libcHandle = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    return _libcHandle
+
+
+def _exchangePaths(first, second):
+    """Atomically exchange two paths (renameat2 with RENAME_EXCHANGE), raises OSError if unsupported."""
+    if not sys.platform.startswith('linux'):
+        raise OSError(errno.ENOSYS, "Exchanging paths is only supported on Linux")
+    try:
+        renameat2 = _libc().renameat2
+    except AttributeError:
+        raise OSError(errno.ENOSYS, "renameat2 is not available in this C library")
+    if renameat2(AT_FDCWD, os.fsencode(first), AT_FDCWD, os.fsencode(second), RENAME_EXCHANGE) != 0:
+        error = ctypes.get_errno()
+        raise OSError(error, os.strerror(error), first, None, second)
+
+
+def stagedPaths(destinationDirectory):
+    """Return the live directory (symlinks resolved) and the staging and previous directories next to it."""
+    liveDirectory = os.path.realpath(destinationDirectory)
+    return liveDirectory, liveDirectory + '.staged', liveDirectory + '.previous'
+
+
+def stageDirectory(run, destinationDirectory):
+    """Create the staging directory with every file of the live tree hardlinked (copied where links fail).
+
+    The copy and modify steps replace files by renaming new ones over them, so the hardlinked live
+    files are never written. Returns the staging directory.
+    """
+    liveDirectory, stagedDirectory, _ = stagedPaths(destinationDirectory)
+    if os.path.exists(liveDirectory) and not os.path.isdir(liveDirectory):
+        raise NotADirectoryError(errno.ENOTDIR, "Destination is not a directory", liveDirectory)
+    if os.path.lexists(stagedDirectory):
+        # Leftover of a failed or interrupted staged run
+        shutil.rmtree(stagedDirectory)
+    os.makedirs(stagedDirectory)
+    if not os.path.isdir(liveDirectory):
+        return stagedDirectory
+
+    files, directories = _scanTree(liveDirectory)
+    for relDir in sorted(directories):
+        os.makedirs(os.path.join(stagedDirectory, relDir), exist_ok=True)
+    copied = 0
+    for relPath in files:
+        try:
+            os.link(os.path.join(liveDirectory, relPath), os.path.join(stagedDirectory, relPath))
+        except OSError as e:
+            if e.errno not in COPY_FALLBACK_ERRNOS:
+                raise
+            shutil.copy2(os.path.join(liveDirectory, relPath), os.path.join(stagedDirectory, relPath))
+            copied += 1
+    for relDir in sorted(directories, reverse=True) + ['']:
+        shutil.copystat(os.path.join(liveDirectory, relDir), os.path.join(stagedDirectory, relDir))
+
+    run.emit('info', 'stage', f"{Colors.CYAN}Staged {len(files)} file(s) of {liveDirectory} in {stagedDirectory} ({len(files) - copied} hardlinked, {copied} copied){Colors.RESET}",
+             live=liveDirectory, staged=stagedDirectory, files=len(files), copied=copied)
+    return stagedDirectory
+
+
+def swapDirectories(run, destinationDirectory):
+    """Put the staged tree in place of the live one, the live tree is kept as the previous one.
+
+    Uses an atomic exchange where the system supports it, otherwise two renames (the destination is
+    missing for a moment).
+    """
+    liveDirectory, stagedDirectory, previousDirectory = stagedPaths(destinationDirectory)
+    if not os.path.lexists(liveDirectory):
+        os.rename(stagedDirectory, liveDirectory)
+        method = 'rename'
+    else:
+        try:
+            _exchangePaths(stagedDirectory, liveDirectory)
+            method = 'exchange'
+        except OSError as e:
+            if e.errno not in COPY_FALLBACK_ERRNOS:
+                raise
+            method = 'rename'
+        if os.path.lexists(previousDirectory):
+            shutil.rmtree(previousDirectory)
+        if method == 'exchange':
+            os.rename(stagedDirectory, previousDirectory)
+        else:
+            os.rename(liveDirectory, previousDirectory)
+            os.rename(stagedDirectory, liveDirectory)
+
+    run.emit('info', 'swap', f"{Colors.GREEN}Swapped the staged tree into {liveDirectory} ({method}), previous tree kept in {previousDirectory}{Colors.RESET}",
+             live=liveDirectory, previous=previousDirectory, method=method)
+
+
+def discardStaged(run, destinationDirectory):
+    """Remove the staged tree of a run that changed nothing, the live and previous trees stay as they are."""
+    liveDirectory, stagedDirectory, previousDirectory = stagedPaths(destinationDirectory)
+    shutil.rmtree(stagedDirectory)
+    run.emit('info', 'swap', f"{Colors.CYAN}Nothing changed, {liveDirectory} was not replaced and {previousDirectory} is kept{Colors.RESET}",
+             live=liveDirectory, previous=previousDirectory, method='none')
+
+
+def rollbackDirectory(run, destinationDirectory):
+    """Exchange the live tree with the previous one, so a second rollback undoes the first."""
+    liveDirectory, _, previousDirectory = stagedPaths(destinationDirectory)
+    if not os.path.isdir(previousDirectory):
+        raise FileNotFoundError(f"No previous tree to roll back to: {previousDirectory}")
+    try:
+        _exchangePaths(previousDirectory, liveDirectory)
+        method = 'exchange'
+    except OSError as e:
+        if e.errno not in COPY_FALLBACK_ERRNOS:
+            raise
+        swapDirectory = liveDirectory + '.rollback'
+        os.rename(liveDirectory, swapDirectory)
+        os.rename(previousDirectory, liveDirectory)
+        os.rename(swapDirectory, previousDirectory)
+        method = 'rename'
+    run.emit('info', 'rollback', f"{Colors.GREEN}Rolled {liveDirectory} back to the previous tree ({method}), the replaced tree is now kept in {previousDirectory}{Colors.RESET}",
+             live=liveDirectory, previous=previousDirectory, method=method)
+
+
+# MARK: Run report
+def newRunReport(dryRun=False):
+    """Create an empty run report, filled by the copy and modify steps (--report, --profile, --dry-run)."""
+    return {"version": REPORT_VERSION, "dryRun": dryRun, "phases": {}, "copyRules": [], "modificationRules": [], "files": []}
+
+
+def finishRunReport(run):
+    """Add the totals and the slowest rules and files to the run report."""
+    report = run.report
+    rules = [dict(rule, phase='copy') for rule in report['copyRules']] + [dict(rule, phase='modify') for rule in report['modificationRules']]
+    report['totals'] = {"copies": run.results['copies'], "modifications": run.results['modifications'], "cacheSkips": run.results['cacheSkips'],
+                        "bytesRead": sum(entry['bytesRead'] for entry in report['files']),
+                        "bytesWritten": sum(entry['bytesWritten'] for entry in report['files']),
+                        "copyErrors": run.errorList['copies'], "modificationErrors": run.errorList['modifications'],
+                        "copyWarnings": run.errorList['copyWarnings'], "modWarnings": run.errorList['modWarnings']}
+    report['slowest'] = {
+        "rules": sorted(rules, key=lambda rule: rule['seconds'], reverse=True)[:PROFILE_TOP],
+        "files": sorted(report['files'], key=lambda entry: entry['seconds'], reverse=True)[:PROFILE_TOP],
+    }
+
+
+def writeRunReport(run, reportPath):
+    """Write the run report as JSON."""
+    with open(reportPath, 'w', encoding='utf-8') as file:
+        json.dump(run.report, file, indent=1)
+    run.emit('info', 'report', f"Run report written to {reportPath}", path=reportPath)
+
+
+def printProfile(run):
+    """Emit the time per phase and the slowest rules and files."""
+    report = run.report
+    lines = [f"\n{Colors.CYAN}Profile:{Colors.RESET}"]
+    for phase, seconds in report['phases'].items():
+        lines.append(f"  {phase:<8} {seconds:8.3f}s")
+
+    lines.append(f"{Colors.CYAN}Slowest rules:{Colors.RESET}")
+    for rule in report['slowest']['rules']:
+        if rule['phase'] == 'copy':
+            detail = f"{rule['files']} file(s), {_formatSize(rule['bytes'] + rule['shared'])}"
+        else:
+            detail = f"/{rule['pattern']}/, {rule['files']} file(s), {_formatSize(rule['bytesRead'])} searched"
+        lines.append(f"  {rule['seconds']:8.3f}s  {rule['phase']} rule #{rule['rule']}: {detail}")
+
+    lines.append(f"{Colors.CYAN}Slowest files:{Colors.RESET}")
+    for entry in report['slowest']['files']:
+        if entry['phase'] == 'modify':
+            detail = f"search {entry['searchSeconds']:.3f}s, write {entry['writeSeconds']:.3f}s, {_formatSize(entry['bytesRead'])} read"
+        else:
+            detail = f"{entry['files']} file(s), {_formatSize(entry['bytesWritten'])} written"
+        lines.append(f"  {entry['seconds']:8.3f}s  {entry['phase']} {entry['path']} ({entry['decision']}, {detail})")
+    run.emit('summary', 'profile', '\n'.join(lines), phases=report['phases'], slowest=report['slowest'])
+
+
+def printPlan(run):
+    """Emit what a dry run would copy, remove and modify."""
+    lines = [f"\n{Colors.CYAN}Dry run, nothing was written. Planned changes:{Colors.RESET}"]
+    planned = [entry for entry in run.report['files'] if entry['decision'] in ('copy', 'modify')]
+    for entry in planned:
+        if entry['phase'] == 'copy':
+            removed = f", remove {entry['removed']} file(s)" if entry['removed'] else ''
+            lines.append(f"  copy    {entry['source']} -> {entry['path']} ({entry['files']} file(s), {_formatSize(entry['bytesWritten'])}{removed})")
+        else:
+            lines.append(f"  modify  {entry['path']} ({entry['modifications']} modification(s), {entry['bytesWritten'] - entry['bytesRead']:+d} bytes)")
+    if not planned:
+        lines.append("  nothing to do")
+    run.emit('summary', 'plan', '\n'.join(lines), planned=planned)
+
+
+def printSummary(run, destinationDirectory, configPath):
+    """Emit the totals of a run."""
+    lines = [f'\n{Colors.GREEN}Total successful copies: {run.results["copies"]}',
+             f'Total file modifications: {run.results["modifications"]}{Colors.RESET}']
+    if run.state is not None:
+        lines.append(f'Total skipped through the cache: {run.results["cacheSkips"]}')
+
+    if run.failed:
+        lines.append(f"{Colors.RED}Errors occurred during the process. Check the output for details.")
+        lines.append(f"Total copy errors: {run.errorList['copies']}")
+        lines.append(f"Total modification errors: {run.errorList['modifications']}{Colors.RESET}")
+    elif run.errorList["copyWarnings"] > 0 or run.errorList["modWarnings"] > 0:
+        lines.append(f"{Colors.GREEN}All operations in {destinationDirectory} from {configPath} completed successfully!{Colors.YELLOW} But there were {run.errorList['modWarnings'] + run.errorList['copyWarnings']} warnings. Maybe you should check them.{Colors.RESET}")
+    else:
+        lines.append(f"{Colors.GREEN}All operations in {destinationDirectory} from {configPath} completed successfully!{Colors.RESET}")
+    run.emit('summary', 'summary', '\n'.join(lines), destination=destinationDirectory, **run.results, **{
+        "copyErrors": run.errorList['copies'], "modificationErrors": run.errorList['modifications'],
+        "copyWarnings": run.errorList['copyWarnings'], "modWarnings": run.errorList['modWarnings']})
+
+
+# MARK: Customizer
+class Customizer:
+    """Copy and modify files according to a configuration, usable from other programs.
+
+    Every run() reports through the event sink. staged builds the result in <destination>.staged and
+    keeps the replaced tree for rollback(), a backupDirectory enables restore().
+    """
+
+    def __init__(self, config, configPath=None, sink=None, statePath=None, force=False, jobs=None, dryRun=False, collectReport=False,
+                 staged=False, sharedInputs=None, backupDirectory=None):
+        self.config = config
+        self.configPath = configPath
+        self.sink = sink if sink is not None else ConsoleSink(OUTPUT_LEVELS['summary'])
+        self.statePath = statePath
+        self.force = force
+        self.jobs = jobs
+        self.dryRun = dryRun
+        self.collectReport = collectReport
+        self.staged = staged
+        self.sharedInputs = sharedInputs
+        self.backupDirectory = backupDirectory
+        self.configSeconds = 0.0
+
+    @classmethod
+    def fromFile(cls, configPath, **options):
+        """Create a customizer from a YAML configuration file (raises like readConfig)."""
+        start = time.perf_counter()
+        customizer = cls(readConfig(configPath), configPath, **options)
+        customizer.configSeconds = time.perf_counter() - start
+        return customizer
+
+    @property
+    def destinationDirectory(self):
+        return self.config.get('destination_directory', './web')
+
+    def run(self, changedPaths=None):
+        """Copy and modify the files once, returns the RunContext with the counters and the run report.
+
+        With changedPaths (absolute paths) only the copy rules touching them run and only the changed
+        files and the files copied by this run are modified (used by watch mode).
+        """
+        report = newRunReport(self.dryRun) if self.collectReport or self.dryRun else None
+        run = RunContext(self.sink, report=report, jobs=self.jobs, dryRun=self.dryRun, sharedInputs=self.sharedInputs)
+        runStart = phaseStart = time.perf_counter()
+        # The configuration is read once, its time counts for the first run only
+        configSeconds, self.configSeconds = self.configSeconds, 0.0
+
+        # Load the state manifest of the previous run (incremental mode)
+        if self.statePath is not None:
+            run.state = newState() if self.force else loadState(run, self.statePath)
+        if report is not None:
+            report['phases']['load'] = configSeconds + time.perf_counter() - phaseStart
+            phaseStart = time.perf_counter()
+
+        # Build a staged copy of the destination instead of changing the live one
+        destinationDirectory = self.destinationDirectory
+        staged = self.staged and not self.dryRun
+        if staged:
+            try:
+                destinationDirectory = stageDirectory(run, self.destinationDirectory)
+            except OSError as e:
+                run.emit('error', 'stage', f"{Colors.RED}Error staging {self.destinationDirectory}: {e}{Colors.RESET}", path=self.destinationDirectory)
+                run.errorList['copies'] += 1
+                printSummary(run, self.destinationDirectory, self.configPath)
+                return run
+            if report is not None:
+                report['phases']['stage'] = time.perf_counter() - phaseStart
+                phaseStart = time.perf_counter()
+
+        # Back up what the run replaces, removes and modifies
+        if self.backupDirectory is not None and not self.dryRun:
+            run.backup = BackupStore(self.backupDirectory, destinationDirectory, self.destinationDirectory)
+
+        # Ensure destination directory
+        ensureDirectory(run, destinationDirectory)
+
+        # Copy files and folders
+        copySources(run, self.config, destinationDirectory, changedPaths)
+        if report is not None:
+            report['phases']['copy'] = time.perf_counter() - phaseStart
+            phaseStart = time.perf_counter()
+
+        # Modify files
+        modifyFiles(run, self.config, destinationDirectory, None if changedPaths is None else changedPaths | run.written)
+        if report is not None:
+            report['phases']['modify'] = time.perf_counter() - phaseStart
+            phaseStart = time.perf_counter()
+
+        # Replace the live directory with the staged one, a failed run leaves the live one untouched
+        if staged and run.failed:
+            run.emit('error', 'swap', f"{Colors.RED}Errors occurred, {self.destinationDirectory} was not replaced. The staged tree is left in {destinationDirectory}{Colors.RESET}",
+                     path=self.destinationDirectory, staged=destinationDirectory)
+        elif staged and not run.written and os.path.isdir(self.destinationDirectory):
+            # Nothing changed, keep the previous tree of the last run that changed something for rollback()
+            try:
+                discardStaged(run, self.destinationDirectory)
+            except OSError as e:
+                run.emit('warning', 'swap', f"{Colors.YELLOW}Error removing the unchanged staged tree {destinationDirectory}: {e}{Colors.RESET}",
+                         path=self.destinationDirectory, staged=destinationDirectory)
+                run.errorList['copyWarnings'] += 1
+        elif staged:
+            try:
+                swapDirectories(run, self.destinationDirectory)
+            except OSError as e:
+                run.emit('error', 'swap', f"{Colors.RED}Error replacing {self.destinationDirectory} with {destinationDirectory}: {e}{Colors.RESET}",
+                         path=self.destinationDirectory, staged=destinationDirectory)
+                run.errorList['copies'] += 1
+            if report is not None:
+                report['phases']['swap'] = time.perf_counter() - phaseStart
+
+        # Write the backup manifest, unless a staged run left the live directory alone
+        if run.backup is not None and not (staged and run.failed):
+            try:
+                runId = run.backup.commit()
+                if runId is not None:
+                    run.emit('info', 'backup', f"{Colors.CYAN}Backup {runId} written to {self.backupDirectory} ({len(run.backup.entries)} file change(s)){Colors.RESET}",
+                             id=runId, path=self.backupDirectory, entries=len(run.backup.entries))
+            except OSError as e:
+                run.emit('error', 'backup', f"{Colors.RED}Error writing the backup manifest to {self.backupDirectory}: {e}{Colors.RESET}", path=self.backupDirectory)
+                run.errorList['copies'] += 1
+
+        # Persist the state manifest for the next run (of a staged run only if it went live)
+        if run.state is not None and not self.dryRun and not (staged and run.failed):
+            saveState(run.state, self.statePath)
+            run.wrote(self.statePath)
+            run.wrote(self.statePath + '.tmp')
+
+        if report is not None:
+            report['phases']['total'] = configSeconds + time.perf_counter() - runStart
+            finishRunReport(run)
+
+        printSummary(run, self.destinationDirectory, self.configPath)
+        if self.dryRun:
+            printPlan(run)
+        return run
+
+    def check(self):
+        """Report which modification rules would break on the new and changed files, returns the RunContext."""
+        run = RunContext(self.sink, jobs=self.jobs, dryRun=True, sharedInputs=self.sharedInputs)
+        if self.statePath is not None and not self.force:
+            run.state = loadState(run, self.statePath)
+        checkModifications(run, self.config, self.destinationDirectory)
+        return run
+
+    def restore(self, runId=None, destinationDirectory=None):
+        """Undo the backed up runs from runId (default: the last one) of a destination, returns the RunContext."""
+        run = RunContext(self.sink)
+        destinationDirectory = destinationDirectory or self.destinationDirectory
+        try:
+            restoreBackup(run, self.backupDirectory, destinationDirectory, runId)
+        except (OSError, ValueError) as e:
+            run.emit('error', 'restore', f"{Colors.RED}Error restoring {destinationDirectory}: {e}{Colors.RESET}", path=destinationDirectory)
+            run.errorList['copies'] += 1
+        return run
+
+    def rollback(self):
+        """Swap the destination with the tree kept by the last staged run, returns the RunContext."""
+        run = RunContext(self.sink)
+        try:
+            rollbackDirectory(run, self.destinationDirectory)
+        except OSError as e:
+            run.emit('error', 'rollback', f"{Colors.RED}Error rolling back {self.destinationDirectory}: {e}{Colors.RESET}", path=self.destinationDirectory)
+            run.errorList['copies'] += 1
+        return run
+
+
+# MARK: Watch mode
+class InotifyWatcher:
+    """Watch directory trees with inotify (Linux, through ctypes), blocking in select() while idle.
+
+    Roots that don't exist (yet) are watched through their nearest existing parent until they appear.
+    Raises OSError if inotify is not available.
+    """
+    name = 'inotify'
+
+    def __init__(self, roots):
+        if not sys.platform.startswith('linux'):
+            raise OSError(errno.ENOSYS, "inotify is only available on Linux")
+        self._fd = _libc().inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self.roots = roots
+        self._watches = {}
+        self.sync()
+
+    def _addWatch(self, directory):
+        watch = _libc().inotify_add_watch(self._fd, os.fsencode(directory), INOTIFY_MASK)
+        if watch >= 0:
+            self._watches[watch] = directory
+        return watch >= 0
+
+    def _addTree(self, directory):
+        """Watch a directory and all directories below it."""
+        pending = [directory]
+        while pending:
+            current = pending.pop()
+            if not self._addWatch(current):
+                continue
+            try:
+                with os.scandir(current) as entries:
+                    pending.extend(entry.path for entry in entries if entry.is_dir(follow_symlinks=False))
+            except OSError:
+                pass
+
+    def sync(self):
+        """Watch the roots that appeared since the last call, missing ones through their nearest existing parent."""
+        watched = set(self._watches.values())
+        for root in self.roots:
+            if os.path.isdir(root):
+                if root not in watched:
+                    self._addTree(root)
+                continue
+            parent = os.path.dirname(root)
+            while not os.path.isdir(parent) and parent != os.path.dirname(parent):
+                parent = os.path.dirname(parent)
+            if parent not in watched:
+                self._addWatch(parent)
+                watched.add(parent)
+
+    def read(self, timeout=None):
+        """Wait up to timeout seconds (None: until something happens) and return the changed paths."""
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return set()
+
+        changed = set()
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                watch, mask, _, length = struct.unpack_from('iIII', data, offset)
+                name = data[offset + 16:offset + 16 + length].rstrip(b'\0')
+                offset += 16 + length
+                if mask & IN_Q_OVERFLOW:
+                    # Events were lost, anything below the roots may have changed
+                    changed.update(self.roots)
+                    continue
+                directory = self._watches.get(watch)
+                if directory is None:
+                    continue
+                if mask & IN_IGNORED:
+                    del self._watches[watch]
+                    continue
+                path = os.path.join(directory, os.fsdecode(name)) if name else directory
+                if not _pathsOverlap(path, self.roots):
+                    continue
+                changed.add(path)
+                # New directories are watched as well, files created before the watch are covered by the directory path
+                if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO) and _underAny(path, set(self.roots)):
+                    self._addTree(path)
+
+        self.sync()
+        return changed
+
+    def close(self):
+        os.close(self._fd)
+
+
+class PollingWatcher:
+    """Fallback watcher comparing stat snapshots of the trees every interval seconds."""
+    name = 'polling'
+
+    def __init__(self, roots, interval=POLL_INTERVAL):
+        self.roots = roots
+        self.interval = interval
+        self._snapshot = self._scan()
+
+    def _scan(self):
+        """Return {path: (inode, size, mtime)} of the files below the roots, directories only count by presence."""
+        snapshot = {}
+        for root in self.roots:
+            try:
+                stat = os.stat(root)
+                if not S_ISDIR(stat.st_mode):
+                    snapshot[root] = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+                    continue
+                files, directories = _scanTree(root)
+            except OSError:
+                continue
+            snapshot[root] = 'directory'
+            snapshot.update((os.path.join(root, relDir), 'directory') for relDir in directories)
+            snapshot.update((os.path.join(root, relPath), (stat.st_ino, stat.st_size, stat.st_mtime_ns)) for relPath, stat in files.items())
+        return snapshot
+
+    def sync(self):
+        pass
+
+    def read(self, timeout=None):
+        """Wait up to timeout seconds (None: until something changed) and return the changed paths."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            time.sleep(self.interval if deadline is None else max(0.0, min(self.interval, deadline - time.monotonic())))
+            snapshot = self._scan()
+            changed = {path for path in snapshot.keys() | self._snapshot.keys() if snapshot.get(path) != self._snapshot.get(path)}
+            self._snapshot = snapshot
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+
+    def close(self):
+        pass
+
+
+def _statKey(path):
+    """Return (inode, size, mtime) of a path, or None if it does not exist."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+def _ownChanges(run):
+    """Snapshot what a run wrote, so the watcher can tell the run's own changes from later ones."""
+    return {path: _statKey(path) for path in run.written}, set(run.removedTrees)
+
+
+def _isOwnChange(path, ownChanges):
+    """Return True if a changed path is still in the state the last run left it in."""
+    written, removedTrees = ownChanges
+    if path in written:
+        return _statKey(path) == written[path]
+    if os.path.lexists(path):
+        return False
+    return bool(TEMP_FILE_NAME.match(os.path.basename(path))) or _underAny(path, removedTrees)
+
+
+def watch(customizer, polling=False, interval=POLL_INTERVAL, debounce=DEBOUNCE_SECONDS):
+    """Customize once, then re-run the affected rules whenever the destination or a copy source changes.
+
+    Bursts of changes (e.g. an upgrade replacing the web directory) are collected until nothing changed
+    for debounce seconds. Changes the runs make themselves are ignored. Runs until interrupted.
+    """
+    def emit(level, message, **fields):
+        customizer.sink.emit(Event('watch', level, message, fields))
+
+    destination = os.path.abspath(customizer.destinationDirectory)
+    copyRulePaths = [_copyRulePaths(rule, destination) for rule in customizer.config.get('copy_rules', [])]
+    patterns = []
+    for rule in customizer.config.get('modification_rules', []):
+        try:
+            patterns.append(re.compile(rule.get('file_pattern', '*')))
+        except re.error:
+            pass  # reported by every run
+
+    # Watch the destination and the copy sources, roots inside other roots are covered by those
+    roots = {destination} | {_staticPrefix(sourcePath) for paths in copyRulePaths for sourcePath, _ in paths}
+    roots = sorted(root for root in roots if not any(root.startswith(other + os.sep) for other in roots))
+
+    watcher = None
+    if not polling:
+        try:
+            watcher = InotifyWatcher(roots)
+        except (OSError, AttributeError) as e:
+            emit('warning', f"{Colors.YELLOW}inotify unavailable ({e}), polling every {interval:g}s instead.{Colors.RESET}")
+    if watcher is None:
+        watcher = PollingWatcher(roots, interval)
+
+    try:
+        ownChanges = _ownChanges(customizer.run())
+        emit('info', f"{Colors.CYAN}Watching {len(roots)} path(s) for changes ({watcher.name}), press Ctrl+C to stop.{Colors.RESET}",
+             roots=roots, backend=watcher.name)
+        while True:
+            changed = watcher.read()
+            while True:
+                more = watcher.read(debounce)
+                if not more:
+                    break
+                changed |= more
+
+            changed = {path for path in changed if not _isOwnChange(path, ownChanges)}
+            if not changed:
+                continue
+
+            # Copy rules whose sources or targets changed, modifications if a matching file or a directory changed
+            copyRules = [index + 1 for index, paths in enumerate(copyRulePaths)
+                         if any(_patternOverlaps(pattern, changed) for pair in paths for pattern in pair)]
+            modify = any(_underAny(path, {destination}) and (os.path.isdir(path) or any(pattern.match(os.path.basename(path)) for pattern in patterns))
+                         for path in changed)
+            if not copyRules and not modify:
+                emit('action', f"Ignoring {len(changed)} change(s) not affecting any rule", paths=sorted(changed))
+                continue
+
+            emit('info', f"\n{Colors.CYAN}{len(changed)} change(s) detected, re-running {len(copyRules)} copy rule(s)"
+                 f"{' and the modifications' if modify else ''}...{Colors.RESET}", paths=sorted(changed), copyRules=copyRules, modify=modify)
+            ownChanges = _ownChanges(customizer.run(changedPaths=changed))
+    finally:
+        watcher.close()
+
+
+# MARK: Fleet mode
+class SharedInputs:
+    """Inputs shared by the runs of several destinations: the compiled modification rules, one process
+    pool for the modifications and the resolved paths, signatures and hashes of the copy sources."""
+
+    def __init__(self, compiledRules, modifyExecutor=None):
+        self.compiledRules = compiledRules
+        self.modifyExecutor = modifyExecutor
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, compute):
+        """Return the value of key, computed once outside the lock (errors are remembered and raised again)."""
+        with self._lock:
+            future = self._values.get(key)
+            computing = future is None
+            if computing:
+                future = self._values[key] = Future()
+        if computing:
+            try:
+                future.set_result(compute())
+            except OSError as e:
+                future.set_exception(e)
+            except BaseException as e:
+                # Not remembered, the next caller computes it again
+                with self._lock:
+                    del self._values[key]
+                future.set_exception(e)
+                raise
+        return future.result()
+
+
+class DestinationSink:
+    """Pass events on with the destination they belong to added to their fields."""
+
+    def __init__(self, sink, destination):
+        self.sink = sink
+        self.destination = destination
+
+    def emit(self, event):
+        self.sink.emit(event._replace(fields=dict(event.fields, destination=self.destination)))
+
+
+def expandDestinations(patterns):
+    """Expand destination directories and glob patterns in order, without duplicates.
+
+    Glob patterns only match directories and skip the staging and previous trees of staged runs.
+    """
+    destinations = []
+    for pattern in patterns:
+        if any(token in pattern for token in ('*', '?', '[')):
+            matches = [match for match in sorted(glob(pattern))
+                       if os.path.isdir(match) and not match.endswith(('.staged', '.previous', '.rollback'))]
+        else:
+            matches = [pattern]
+        destinations.extend(os.path.normpath(match) for match in matches if os.path.normpath(match) not in destinations)
+    return destinations
+
+
+def fleetStatePath(statePath, destination):
+    """Return the state manifest of one destination, next to the given one."""
+    return f"{os.path.splitext(statePath)[0]}.{fingerprint(os.path.abspath(destination))[:12]}.json"
+
+
+def runFleet(customizer, destinations, parallel=None):
+    """Run the customizer for several destinations at once, returns [(destination, RunContext or exception, seconds)].
+
+    The modification rules are compiled once and share one process pool, copy sources are resolved, scanned
+    and hashed once. At most parallel destinations (default FLEET_THREADS) are processed at the same time.
+    """
+    fleetRun = RunContext(customizer.sink)
+    compiledRules = compileModificationRules(fleetRun, customizer.config)
+
+    jobs = customizer.jobs or os.cpu_count() or 1
+    modifyExecutor = None
+    if jobs > 1:
+        try:
+            modifyExecutor = _newModifyPool(jobs, compiledRules)
+            # Start the workers from the main thread, before the destination threads exist
+            modifyExecutor.submit(os.getpid).result()
+        except (OSError, NotImplementedError) as e:
+            fleetRun.emit('warning', 'pool', f"{Colors.YELLOW}Process pool unavailable ({e}), modifying files serially.{Colors.RESET}")
+            modifyExecutor = None
+    sharedInputs = SharedInputs(compiledRules, modifyExecutor)
+
+    def runDestination(destination):
+        start = time.perf_counter()
+        statePath = None if customizer.statePath is None else fleetStatePath(customizer.statePath, destination)
+        member = Customizer(dict(customizer.config, destination_directory=destination), customizer.configPath,
+                            DestinationSink(customizer.sink, destination), statePath, customizer.force, customizer.jobs,
+                            customizer.dryRun, customizer.collectReport, customizer.staged, sharedInputs, customizer.backupDirectory)
+        try:
+            outcome = member.run()
+        except Exception as e:
+            member.sink.emit(Event('fleet', 'error', f"{Colors.RED}Error processing {destination}: {e}{Colors.RESET}", {}))
+            outcome = e
+        return destination, outcome, time.perf_counter() - start
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(parallel or FLEET_THREADS, len(destinations)))) as executor:
+            results = list(executor.map(runDestination, destinations))
+    finally:
+        if modifyExecutor is not None:
+            modifyExecutor.shutdown()
+
+    # Configuration errors of the modification rules were reported once but affect every destination
+    for _, outcome, _ in results:
+        if isinstance(outcome, RunContext):
+            outcome.errorList['modifications'] += fleetRun.errorList['modifications']
+
+    printFleetSummary(fleetRun, results)
+    return results
+
+
+def printFleetSummary(run, results):
+    """Emit one table row with the totals and status per destination."""
+    width = max([len('Destination')] + [len(destination) for destination, _, _ in results])
+    lines = [f"\n{Colors.CYAN}{'Destination':<{width}}  {'Copies':>6}  {'Modified':>8}  {'Cached':>6}  {'Warnings':>8}  {'Errors':>6}  {'Time':>8}  Status{Colors.RESET}"]
+    rows = []
+    for destination, outcome, seconds in results:
+        if isinstance(outcome, RunContext):
+            warnings = outcome.errorList['copyWarnings'] + outcome.errorList['modWarnings']
+            errors = outcome.errorList['copies'] + outcome.errorList['modifications']
+            status = 'failed' if outcome.failed else 'ok'
+            color = Colors.RED if outcome.failed else Colors.YELLOW if warnings else Colors.GREEN
+            lines.append(f"{color}{destination:<{width}}  {outcome.results['copies']:>6}  {outcome.results['modifications']:>8}  {outcome.results['cacheSkips']:>6}  "
+                         f"{warnings:>8}  {errors:>6}  {seconds:>7.2f}s  {status}{Colors.RESET}")
+            rows.append({"destination": destination, **outcome.results, "warnings": warnings, "errors": errors, "seconds": seconds, "status": status})
+        else:
+            lines.append(f"{Colors.RED}{destination:<{width}}  {'-':>6}  {'-':>8}  {'-':>6}  {'-':>8}  {'-':>6}  {seconds:>7.2f}s  error: {outcome}{Colors.RESET}")
+            rows.append({"destination": destination, "seconds": seconds, "status": "error", "error": str(outcome)})
+
+    failed = sum(1 for row in rows if row['status'] != 'ok')
+    if run.failed:
+        lines.append(f"{Colors.RED}Invalid modification rules, see the configuration errors above.{Colors.RESET}")
+    lines.append(f"{Colors.RED if failed or run.failed else Colors.GREEN}{len(rows) - failed} of {len(rows)} destination(s) completed successfully.{Colors.RESET}")
+    run.emit('summary', 'fleet', '\n'.join(lines), destinations=rows)
+
+
+def writeFleetReport(run, results, reportPath):
+    """Write the run reports of all destinations as one JSON document."""
+    reports = [dict(outcome.report, destination=destination) if isinstance(outcome, RunContext) else {"destination": destination, "error": str(outcome)}
+               for destination, outcome, _ in results]
+    with open(reportPath, 'w', encoding='utf-8') as file:
+        json.dump({"version": REPORT_VERSION, "destinations": reports}, file, indent=1)
+    run.emit('info', 'report', f"Run report written to {reportPath}", path=reportPath)
+
+
+# MARK: Main function
+def parseArguments(argv=None):
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(description="Copy and modify files (e.g. the Jellyfin web directory) according to a YAML configuration.")
+    parser.add_argument('config', help="path to the YAML configuration file")
+    parser.add_argument('--state', nargs='?', const='', default=None, metavar='PATH',
+                        help="remember file hashes between runs and skip unchanged files (default: <config>.state.json)")
+    parser.add_argument('--force', action='store_true',
+                        help="ignore the state manifest and process every file again")
+    parser.add_argument('--jobs', type=int, default=None, metavar='N',
+                        help="number of processes used to modify files (default: number of CPUs)")
+    parser.add_argument('--report', metavar='PATH',
+                        help="write a JSON run report with the time, bytes and decisions per phase, rule and file")
+    parser.add_argument('--profile', action='store_true',
+                        help="print the time per phase and the slowest rules and files at the end")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="only show what would be copied and modified, nothing is written")
+    parser.add_argument('--output', choices=('verbose', 'summary', 'quiet', 'json'), default=None,
+                        help="console output: every action (verbose), progress, warnings and totals (summary), errors only "
+                             "(quiet) or JSON lines (json); default: verbose in a terminal, summary otherwise")
+    parser.add_argument('--watch', action='store_true',
+                        help="keep running and re-apply the affected rules whenever the destination or a copy source changes")
+    parser.add_argument('--debounce', type=float, default=DEBOUNCE_SECONDS, metavar='SECONDS',
+                        help=f"watch mode: wait until nothing changed for this long before re-running (default: {DEBOUNCE_SECONDS:g})")
+    parser.add_argument('--poll', nargs='?', type=float, const=POLL_INTERVAL, default=None, metavar='SECONDS',
+                        help=f"watch mode: poll for changes every SECONDS (default: {POLL_INTERVAL:g}) instead of using inotify")
+    parser.add_argument('--staged', action='store_true',
+                        help="build the result next to the destination (unchanged files hardlinked) and swap it in at once, "
+                             "the replaced tree is kept as <destination>.previous")
+    parser.add_argument('--destinations', nargs='+', metavar='DIR',
+                        help="apply the configuration to these destination directories or glob patterns instead of destination_directory")
+    parser.add_argument('--parallel', type=int, default=None, metavar='N',
+                        help=f"number of destinations processed at the same time (default: {FLEET_THREADS})")
+    parser.add_argument('--backup', nargs='?', const='', default=None, metavar='DIR',
+                        help="back up every file a run replaces, removes or modifies (default: <config>.backups)")
+    parser.add_argument('--restore', nargs='?', const='', default=None, metavar='RUN_ID',
+                        help="undo the backed up runs from RUN_ID (default: the last run) and exit")
+    parser.add_argument('--rollback', action='store_true',
+                        help="swap the destination with the tree kept by the last staged run and exit")
+    parser.add_argument('--check', action='store_true',
+                        help="only try the modification rules on new and changed files (see --state) and report the rules expected to break")
+    args = parser.parse_args(argv)
+    if args.watch and (args.dry_run or args.report or args.profile or args.staged):
+        parser.error("--watch can't be combined with --dry-run, --report, --profile or --staged")
+    if args.staged and args.dry_run:
+        parser.error("--staged can't be combined with --dry-run")
+    if args.rollback and (args.watch or args.staged or args.dry_run):
+        parser.error("--rollback can't be combined with --watch, --staged or --dry-run")
+    if args.destinations and (args.watch or args.rollback):
+        parser.error("--destinations can't be combined with --watch or --rollback")
+    if args.restore is not None and (args.watch or args.staged or args.dry_run or args.rollback):
+        parser.error("--restore can't be combined with --watch, --staged, --dry-run or --rollback")
+    if args.restore is not None and args.destinations and len(args.destinations) > 1:
+        parser.error("--restore takes a single --destinations entry")
+    if args.check and (args.watch or args.staged or args.rollback or args.restore is not None or args.destinations or args.backup is not None):
+        parser.error("--check can't be combined with --watch, --staged, --rollback, --restore, --destinations or --backup")
+    return args
+
+
+def main():
+    """Main function to execute all operations."""
+    args = parseArguments()
+    sink = createSink(args.output or ('verbose' if sys.stdout.isatty() else 'summary'))
+
+    # Load configuration
+    configStart = time.perf_counter()
+    config = loadConfig(args.config, sink)
+    configSeconds = time.perf_counter() - configStart
+
+    statePath = None
+    if args.state is not None:
+        statePath = args.state or defaultStatePath(args.config)
+
+    backupDirectory = None
+    if args.backup is not None or args.restore is not None:
+        backupDirectory = args.backup or defaultBackupPath(args.config)
+
+    customizer = Customizer(config, args.config, sink, statePath, args.force, args.jobs, args.dry_run,
+                            collectReport=bool(args.report or args.profile), staged=args.staged, backupDirectory=backupDirectory)
+    customizer.configSeconds = configSeconds
+    if args.restore is not None:
+        destination = None
+        if args.destinations:
+            destinations = expandDestinations(args.destinations)
+            if len(destinations) != 1:
+                sink.emit(Event('restore', 'error', f"{Colors.RED}Error: --restore needs exactly one destination directory, {args.destinations[0]} matches {len(destinations)}{Colors.RESET}", {}))
+                sys.exit(1)
+            destination = destinations[0]
+        if customizer.restore(args.restore or None, destination).failed:
+            sys.exit(1)
+        return
+    if args.rollback:
+        if customizer.rollback().failed:
+            sys.exit(1)
+        return
+    if args.check:
+        # Exit status 1 if any rule is expected to break
+        if customizer.check().failed:
+            sys.exit(1)
+        return
+    if args.destinations:
+        destinations = expandDestinations(args.destinations)
+        if not destinations:
+            sink.emit(Event('fleet', 'error', f"{Colors.RED}Error: no destination directory matches {' '.join(args.destinations)}{Colors.RESET}", {}))
+            sys.exit(1)
+        results = runFleet(customizer, destinations, args.parallel)
+        runs = [outcome for _, outcome, _ in results if isinstance(outcome, RunContext)]
+        if args.profile:
+            for run in runs:
+                printProfile(run)
+        if args.report:
+            writeFleetReport(RunContext(sink), results, args.report)
+        # Exit status 1 if any destination failed
+        if len(runs) < len(results) or any(run.failed for run in runs):
+            sys.exit(1)
+        return
+    if args.watch:
+        try:
+            watch(customizer, polling=args.poll is not None, interval=args.poll or POLL_INTERVAL, debounce=args.debounce)
+        except KeyboardInterrupt:
+            sink.emit(Event('watch', 'info', f"\n{Colors.CYAN}Stopped watching.{Colors.RESET}", {}))
+        return
+    run = customizer.run()
+
+    # Report the timings
+    if args.profile:
+        printProfile(run)
+    if args.report:
+        writeRunReport(run, args.report)
+
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
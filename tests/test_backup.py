@@ -0,0 +1,93 @@
+"""Restoring a backup brings the destination back to its state before the undone runs."""
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import customize_webui
+
+
+def writeFile(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as file:
+        file.write(content)
+
+
+def readFile(path):
+    with open(path) as file:
+        return file.read()
+
+
+def snapshot(root):
+    """Return {relative path: content or None for directories} of a tree."""
+    tree = {}
+    for directory, directories, files in os.walk(root):
+        for name in directories:
+            tree[os.path.relpath(os.path.join(directory, name), root)] = None
+        for name in files:
+            tree[os.path.relpath(os.path.join(directory, name), root)] = readFile(os.path.join(directory, name))
+    return tree
+
+
+class BackupTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+        self.web = os.path.join(self.root, 'web')
+        self.backups = os.path.join(self.root, 'backups')
+        writeFile(os.path.join(self.web, 'index.html'), '<head></head>')
+        writeFile(os.path.join(self.web, 'logo.png'), 'old logo')
+        writeFile(os.path.join(self.root, 'img', 'logo.png'), 'new logo')
+        writeFile(os.path.join(self.root, 'img', 'background.png'), 'background')
+        self.config = {
+            "destination_directory": self.web,
+            "copy_rules": [
+                {"sources": [{"source": os.path.join(self.root, 'img', 'logo.png'), "target": 'logo.png'}], "mode": 'replace'},
+                {"sources": [{"source": os.path.join(self.root, 'img', 'background.png'), "target": 'assets/img/background.png'}], "mode": 'copy'},
+            ],
+            "modification_rules": [{"file_pattern": 'index.html', "insert_rules": [{"after_text": '<head>', "insert_text": '<style></style>'}]}],
+        }
+
+    def customizer(self):
+        return customize_webui.Customizer(self.config, sink=customize_webui.ConsoleSink(levels=()), backupDirectory=self.backups)
+
+    def test_restore_undoes_edits_replacements_and_created_paths(self):
+        original = snapshot(self.web)
+        self.assertFalse(self.customizer().run().failed)
+        self.assertEqual(readFile(os.path.join(self.web, 'index.html')), '<head><style></style></head>')
+        self.assertEqual(readFile(os.path.join(self.web, 'assets', 'img', 'background.png')), 'background')
+
+        self.assertFalse(self.customizer().restore().failed)
+        self.assertEqual(snapshot(self.web), original)
+        self.assertEqual(os.listdir(os.path.join(self.backups, 'runs')), [])
+        self.assertEqual(os.listdir(os.path.join(self.backups, 'blobs')), [])
+
+    def test_restore_through_several_runs(self):
+        original = snapshot(self.web)
+        self.customizer().run()
+        writeFile(os.path.join(self.root, 'img', 'logo.png'), 'newer logo')
+        self.customizer().run()
+        runs = customize_webui.loadBackupRuns(self.backups)
+        self.assertEqual(len(runs), 2)
+
+        self.assertFalse(self.customizer().restore(runs[0]['id']).failed)
+        self.assertEqual(snapshot(self.web), original)
+
+    def test_restore_leaves_files_changed_since_the_backup(self):
+        self.customizer().run()
+        writeFile(os.path.join(self.web, 'index.html'), '<head>edited by hand</head>')
+
+        run = self.customizer().restore()
+        self.assertTrue(run.failed)
+        self.assertEqual(readFile(os.path.join(self.web, 'index.html')), '<head>edited by hand</head>')
+        self.assertEqual(readFile(os.path.join(self.web, 'logo.png')), 'old logo')
+        # The refused file stays in the backup, so it can still be restored later
+        entries = [entry for manifest in customize_webui.loadBackupRuns(self.backups) for entry in manifest['entries']]
+        self.assertEqual([entry['path'] for entry in entries], ['index.html'])
+
+
+if __name__ == '__main__':
+    unittest.main()
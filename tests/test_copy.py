@@ -0,0 +1,98 @@
+"""Copy rules write complete files and keep synchronized directories in line with their source."""
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import customize_webui
+
+
+class CopyFileTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.source = os.path.join(self.directory.name, 'source')
+        self.target = os.path.join(self.directory.name, 'target')
+        with open(self.source, 'wb') as file:
+            file.write(b'0123456789' * 1000)
+
+    def assertCopied(self):
+        with open(self.source, 'rb') as source, open(self.target, 'rb') as target:
+            self.assertEqual(source.read(), target.read())
+
+    def test_copy(self):
+        size, _ = customize_webui.copyFile(self.source, self.target)
+        self.assertEqual(size, 10000)
+        self.assertCopied()
+
+    def test_kernel_copy_copying_nothing_falls_back(self):
+        with mock.patch.object(os, 'copy_file_range', return_value=0, create=True), \
+             mock.patch.object(os, 'sendfile', return_value=0, create=True):
+            _, method = customize_webui.copyFile(self.source, self.target)
+        self.assertEqual(method, 'buffered')
+        self.assertCopied()
+
+    def test_kernel_copy_stopping_early_is_completed(self):
+        calls = []
+
+        def copyFileRange(sourceFd, targetFd, count):
+            calls.append(count)
+            if len(calls) > 1:
+                return 0
+            os.write(targetFd, os.read(sourceFd, 4096))
+            return 4096
+
+        with mock.patch.object(os, 'copy_file_range', copyFileRange, create=True):
+            _, method = customize_webui.copyFile(self.source, self.target)
+        self.assertEqual(method, 'buffered')
+        self.assertCopied()
+
+
+class SyncTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.web = os.path.join(directory.name, 'web')
+        self.source = os.path.join(directory.name, 'featured')
+        self.target = os.path.join(self.web, 'featured')
+        for root, files in ((self.source, {'script.js': 'new script', 'styles.css': 'styles', 'img/a.png': 'a'}),
+                            (self.target, {'script.js': 'old script', 'styles.css': 'styles', 'stale.js': 'stale', 'old/b.png': 'b'})):
+            for relPath, content in files.items():
+                os.makedirs(os.path.dirname(os.path.join(root, relPath)), exist_ok=True)
+                with open(os.path.join(root, relPath), 'w') as file:
+                    file.write(content)
+        # Same content as the source, but an older mtime
+        os.utime(os.path.join(self.target, 'styles.css'), (1000000000, 1000000000))
+
+    def sync(self, **options):
+        rule = dict({"sources": [{"source": self.source, "target": 'featured'}], "mode": 'merge'}, **options)
+        config = {"destination_directory": self.web, "copy_rules": [rule]}
+        return customize_webui.Customizer(config, sink=customize_webui.ConsoleSink(levels=())).run()
+
+    def tree(self):
+        tree = {}
+        for root, _, files in os.walk(self.target):
+            for name in files:
+                with open(os.path.join(root, name)) as file:
+                    tree[os.path.relpath(os.path.join(root, name), self.target)] = file.read()
+        return tree
+
+    def test_sync_keeps_files_missing_in_the_source(self):
+        self.assertFalse(self.sync().failed)
+        self.assertEqual(self.tree(), {'script.js': 'new script', 'styles.css': 'styles', os.path.join('img', 'a.png'): 'a',
+                                       'stale.js': 'stale', os.path.join('old', 'b.png'): 'b'})
+        # Unchanged content only gets the source mtime, so the next run decides by stat alone
+        self.assertEqual(os.stat(os.path.join(self.target, 'styles.css')).st_mtime_ns,
+                         os.stat(os.path.join(self.source, 'styles.css')).st_mtime_ns)
+
+    def test_sync_with_delete_removes_files_missing_in_the_source(self):
+        self.assertFalse(self.sync(delete=True).failed)
+        self.assertEqual(self.tree(), {'script.js': 'new script', 'styles.css': 'styles', os.path.join('img', 'a.png'): 'a'})
+        self.assertFalse(os.path.exists(os.path.join(self.target, 'old')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+"""The runs of a fleet share their inputs, each input is computed once and without blocking the others."""
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import customize_webui
+
+
+class SharedInputsTest(unittest.TestCase):
+    def test_keys_are_computed_independently(self):
+        inputs = customize_webui.SharedInputs([])
+        started, otherComputed = threading.Event(), threading.Event()
+
+        def slow():
+            # Only finishes in time if the other key can be computed meanwhile
+            started.set()
+            return otherComputed.wait(5)
+
+        results = []
+        thread = threading.Thread(target=lambda: results.append(inputs.get('slow', slow)))
+        thread.start()
+        started.wait(5)
+        self.assertEqual(inputs.get('other', lambda: 'value'), 'value')
+        otherComputed.set()
+        thread.join()
+        self.assertEqual(results, [True])
+
+    def test_value_is_computed_once(self):
+        inputs = customize_webui.SharedInputs([])
+        calls = []
+        started, release = threading.Event(), threading.Event()
+
+        def compute():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return len(calls)
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(inputs.get('key', compute))) for _ in range(4)]
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual((calls, results), ([1], [1] * 4))
+
+    def test_errors_are_raised_again(self):
+        inputs = customize_webui.SharedInputs([])
+        calls = []
+
+        def missing():
+            calls.append(1)
+            raise FileNotFoundError('missing')
+
+        for _ in range(2):
+            with self.assertRaises(FileNotFoundError):
+                inputs.get('missing', missing)
+        self.assertEqual(len(calls), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+"""Modification rules give the same result as applying every edit on the file text one after another."""
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import customize_webui
+
+
+def modify(content, rules):
+    """Run the rules on a temporary file, return (new content, result)."""
+    run = customize_webui.RunContext(sink=customize_webui.ConsoleSink(levels=()))
+    compiledRules = customize_webui.compileModificationRules(run, {"modification_rules": [dict(rule, file_pattern='f') for rule in rules]})
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'f')
+        with open(path, 'wb') as file:
+            file.write(content.encode('utf-8'))
+        result = customize_webui.modifyFile(path, compiledRules)
+        with open(path, 'rb') as file:
+            return file.read().decode('utf-8'), result
+
+
+class ModifyFileTest(unittest.TestCase):
+    def test_anchor_inserted_by_the_same_rule(self):
+        content, result = modify('abc', [{"insert_rules": [{"after_text": 'abc', "insert_text": 'XYZ'},
+                                                           {"after_text": 'XYZ', "insert_text": '123'}]}])
+        self.assertEqual(content, 'abcXYZ123')
+        self.assertEqual(result['errors'], 0)
+
+    def test_anchor_replaced_by_an_earlier_rule(self):
+        content, result = modify('abc def', [{"replace_rules": [{"old_text": 'def', "new_text": 'ghi'}]},
+                                             {"insert_rules": [{"after_text": 'ghi', "insert_text": '!'}]}])
+        self.assertEqual(content, 'abc ghi!')
+        self.assertEqual(result['errors'], 0)
+
+    def test_marker_across_text_removed_by_an_earlier_rule(self):
+        content, result = modify('bXc', [{"replace_rules": [{"old_text": 're:()X', "new_text": '\\1'}]},
+                                         {"insert_rules": [{"after_text": 'bc', "insert_text": '!'}]}])
+        self.assertEqual(content, 'bc!')
+        self.assertEqual(result['errors'], 0)
+
+    def test_same_insertion_of_two_rules_is_written_once(self):
+        rule = {"insert_rules": [{"after_text": 'abc', "insert_text": 'X'}]}
+        content, result = modify('abc', [rule, rule])
+        self.assertEqual(content, 'abcX')
+        self.assertEqual((result['modifications'], result['warnings']), (1, 1))
+
+    def test_regex_replacement_does_not_match_across_lines(self):
+        content, result = modify('a1\nb2', [{"replace_rules": [{"old_text": 're:a1.b2', "new_text": 'x'}]}])
+        self.assertEqual(content, 'a1\nb2')
+        self.assertEqual((result['errors'], result['warnings']), (0, 1))
+
+    def test_regex_marker_with_str_only_syntax(self):
+        rule = {"insert_rules": [{"after_text": 're:\\u00e4x', "insert_text": '!'}]}
+        self.assertEqual(modify('\u00e4x', [rule])[0], '\u00e4x!')
+        rule = {"insert_rules": [{"after_text": 're:(?u)\\w+', "insert_text": '!'}]}
+        self.assertEqual(modify('abc def', [rule])[0], 'abc! def')
+
+    def test_regex_match_after_non_ascii_text(self):
+        content = '\u00e4\u20ac\U0001f600' * 40000 + 'anchor'
+        content, result = modify(content, [{"insert_rules": [{"before_text": 're:anch.r', "insert_text": '!'}]}])
+        self.assertTrue(content.endswith('\U0001f600!anchor'))
+        self.assertEqual(result['errors'], 0)
+
+    def test_anchor_ranges_follow_later_edits(self):
+        run = customize_webui.RunContext(sink=customize_webui.ConsoleSink(levels=()))
+        rules = [{"file_pattern": 'f', "insert_rules": [{"after_text": 'end', "insert_text": '!'}]},
+                 {"file_pattern": 'f', "insert_rules": [{"before_text": 'start', "insert_text": '<<'}]}]
+        compiledRules = customize_webui.compileModificationRules(run, {"modification_rules": rules})
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'f')
+            with open(path, 'wb') as file:
+                file.write(b'start middle end')
+            result = customize_webui.modifyFile(path, compiledRules, recordState=True)
+            with open(path, 'rb') as file:
+                content = file.read()
+            self.assertEqual(content, b'<<start middle end!')
+            self.assertEqual([content[start:end] for _, start, end, _ in result['anchors']], [b'end!', b'<<start'])
+            self.assertTrue(customize_webui.verifyAnchors(path, len(content), result['anchors']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+"""Staged runs build the result next to the live tree and never write the live files."""
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import customize_webui
+
+
+def writeFile(path, content, mtime=None):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as file:
+        file.write(content)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+def readFile(path):
+    with open(path) as file:
+        return file.read()
+
+
+class StagedRunTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+        self.web = os.path.join(self.root, 'web')
+        self.source = os.path.join(self.root, 'source')
+        writeFile(os.path.join(self.web, 'index.html'), 'index', mtime=1000000000)
+        writeFile(os.path.join(self.source, 'index.html'), 'index', mtime=1500000000)
+
+    def customizer(self, sources, mode='merge'):
+        config = {"destination_directory": self.web,
+                  "copy_rules": [{"sources": [{"source": source, "target": target} for source, target in sources], "mode": mode}]}
+        return customize_webui.Customizer(config, sink=customize_webui.ConsoleSink(levels=()), staged=True)
+
+    def test_synchronized_mtime_leaves_the_previous_tree_alone(self):
+        before = os.stat(os.path.join(self.web, 'index.html'))
+        run = self.customizer([(self.source, '.')]).run()
+        self.assertFalse(run.failed)
+        previous = os.stat(os.path.join(self.web + '.previous', 'index.html'))
+        self.assertEqual((previous.st_ino, previous.st_mtime_ns), (before.st_ino, before.st_mtime_ns))
+        self.assertEqual(os.stat(os.path.join(self.web, 'index.html')).st_mtime, 1500000000)
+
+
+    def test_swap_keeps_the_live_tree_as_previous(self):
+        live = os.stat(os.path.join(self.web, 'index.html'))
+        run = self.customizer([(os.path.join(self.source, 'index.html'), 'added.html')], mode='copy').run()
+        self.assertFalse(run.failed)
+        self.assertEqual(sorted(os.listdir(self.web)), ['added.html', 'index.html'])
+        self.assertEqual(os.listdir(self.web + '.previous'), ['index.html'])
+        self.assertEqual(os.stat(os.path.join(self.web + '.previous', 'index.html')).st_ino, live.st_ino)
+        self.assertFalse(os.path.exists(self.web + '.staged'))
+
+    def test_run_without_changes_keeps_both_trees(self):
+        customizer = self.customizer([(os.path.join(self.source, 'index.html'), 'added.html')], mode='copy')
+        customizer.run()
+        live, previous = os.stat(self.web), os.stat(self.web + '.previous')
+        run = customizer.run()
+        self.assertFalse(run.failed)
+        self.assertEqual(os.stat(self.web).st_ino, live.st_ino)
+        self.assertEqual(os.stat(self.web + '.previous').st_ino, previous.st_ino)
+        self.assertEqual(os.listdir(self.web + '.previous'), ['index.html'])
+        self.assertFalse(os.path.exists(self.web + '.staged'))
+
+    def test_second_rollback_undoes_the_first(self):
+        customizer = self.customizer([(os.path.join(self.source, 'index.html'), 'added.html')], mode='copy')
+        customizer.run()
+        self.assertFalse(customizer.rollback().failed)
+        self.assertEqual(os.listdir(self.web), ['index.html'])
+        self.assertEqual(sorted(os.listdir(self.web + '.previous')), ['added.html', 'index.html'])
+        self.assertFalse(customizer.rollback().failed)
+        self.assertEqual(sorted(os.listdir(self.web)), ['added.html', 'index.html'])
+        self.assertEqual(readFile(os.path.join(self.web, 'added.html')), 'index')
+
+    def test_rollback_without_previous_tree_fails(self):
+        self.assertTrue(self.customizer([]).rollback().failed)
+        self.assertEqual(os.listdir(self.web), ['index.html'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+"""The stat cache answers repeated lookups from its snapshot until a path is invalidated."""
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import customize_webui
+
+
+class StatCacheTest(unittest.TestCase):
+    def test_missing_name_is_checked_once(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = customize_webui.StatCache()
+            path = os.path.join(directory, 'missing')
+            with mock.patch.object(os, 'stat', wraps=os.stat) as stat:
+                results = [cache.exists(path) for _ in range(5)]
+            self.assertEqual(results, [False] * 5)
+            self.assertEqual(stat.call_count, 1)
+
+    def test_invalidated_name_is_checked_again(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = customize_webui.StatCache()
+            path = os.path.join(directory, 'created')
+            self.assertFalse(cache.exists(path))
+            open(path, 'w').close()
+            self.assertFalse(cache.exists(path))
+            cache.invalidate(path)
+            self.assertTrue(cache.exists(path))
+
+
+if __name__ == '__main__':
+    unittest.main()